@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BasecartConfig(AppConfig):
     name = 'basecart'
+
+    def ready(self):
+        # connects the Product signal receivers
+        from . import productcache, search, searchindex, facets, images
@@ -0,0 +1,133 @@
+import json
+import hashlib
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+from .models import Cart, CartRequest, CartActivityLogger, Product
+from .serializers import CartSerializer
+
+MAX_OPERATIONS = getattr(settings, 'CART_BATCH_MAX_OPERATIONS', 200)
+# how long an idempotency key is remembered, a retry after that runs again
+RETENTION_HOURS = getattr(settings, 'CART_REQUEST_RETENTION_HOURS', 24)
+PRUNE_BATCH_SIZE = 5000
+
+Add = 'add'
+Update = 'update'
+Remove = 'remove'
+OPERATIONS = (Add, Update, Remove)
+
+ACTIONS = {
+	Add: CartActivityLogger.Addedtocart,
+	Update: CartActivityLogger.Updatedcart,
+	Remove: CartActivityLogger.Removedfromcart,
+}
+
+class KeyReused(ValueError):
+	pass
+
+def apply_operations(user, operations, events):
+	"""
+	Applies [{'op','product','quantity','status'}] to the cart of user in
+	order and returns one result per operation. Lines of every product in
+	the batch are locked up front, so the (user, product) unique index is
+	only hit by a concurrent insert, which raises IntegrityError.
+
+	(action, product name, comment) of every change is appended to events.
+	"""
+	ids = set(operation['product'] for operation in operations)
+	products = Product.objects.only('id','name').in_bulk(ids)
+	lines = dict((line.product_id, line) for line in Cart.objects.select_for_update().filter(user=user, product_id__in=ids))
+	results = []
+	for operation in operations:
+		op = operation['op']
+		product = products.get(operation['product'])
+		line = lines.get(operation['product'])
+		result = {'op':op, 'product':operation['product'], 'status':'ok', 'error':'', 'data':''}
+		results.append(result)
+		if product is None:
+			result.update(status='fail', error='product does not exist')
+			continue
+		if op != Add and line is None:
+			result.update(status='fail', error='product not in cart')
+			continue
+		if op == Remove:
+			result['data'] = CartSerializer(line).data
+			line.delete()
+			del lines[product.id]
+			events.append((ACTIONS[op], product.name, 'removed from cart'))
+			continue
+		if op == Add:
+			if line is None:
+				line = lines[product.id] = Cart(user=user, product=product, quantity=0)
+			line.quantity += operation.get('quantity', 1)
+			line.status = operation.get('status', Cart.Inorder)
+		else:
+			line.quantity = operation.get('quantity', line.quantity)
+			line.status = operation.get('status', line.status)
+		line.save()
+		result['data'] = CartSerializer(line).data
+		events.append((ACTIONS[op], product.name, '%s quantity = %s' % (op, line.quantity)))
+	return results
+
+def digest(payload):
+	return hashlib.sha1(json.dumps(payload, sort_keys=True, cls=JSONEncoder).encode('utf8')).hexdigest()
+
+def run_once(user, key, payload, run):
+	"""
+	Calls run() in a transaction and stores what it returns under key, so
+	a retry with the same key gets the stored value back instead of
+	running again. Returns (value, replayed).
+	"""
+	with transaction.atomic():
+		record = None
+		if key:
+			try:
+				with transaction.atomic():
+					record = CartRequest.objects.create(user=user, key=key, digest=digest(payload))
+			except IntegrityError:
+				# a concurrent request with the same key blocks on the unique
+				# index until the first one commits, so its response is there
+				record = CartRequest.objects.get(user=user, key=key)
+				if record.digest != digest(payload):
+					raise KeyReused('idempotency key was used for a different request')
+				return json.loads(record.response), True
+		value = run()
+		if record is not None:
+			record.response = json.dumps(value, cls=JSONEncoder)
+			record.save(update_fields=['response'])
+	return value, False
+
+def apply_batch(user, operations, key=None):
+	"""
+	Runs a batch of cart operations in one transaction, at most once per
+	idempotency key. Returns (results, events, replayed).
+	"""
+	for attempt in range(2):
+		events = []
+		try:
+			results, replayed = run_once(user, key, operations, lambda: apply_operations(user, operations, events))
+			return results, events, replayed
+		except IntegrityError:
+			# another request added one of the products after our lines were
+			# locked, the second attempt finds and locks its row
+			if attempt:
+				raise
+
+def prune_requests(now=None, batch_size=PRUNE_BATCH_SIZE):
+	"""
+	Deletes stored batch responses older than RETENTION_HOURS, a batch at
+	a time, and returns how many were deleted.
+	"""
+	cutoff = (now or timezone.now())-timedelta(hours=RETENTION_HOURS)
+	old = CartRequest.objects.filter(created__lt=cutoff)
+	deleted = 0
+	while True:
+		# short transactions so batch requests are never blocked for long
+		ids = list(old.order_by('created','id').values_list('id', flat=True)[:batch_size])
+		if not ids:
+			break
+		CartRequest.objects.filter(id__in=ids).delete()
+		deleted += len(ids)
+	return deleted
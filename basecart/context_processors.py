@@ -0,0 +1,23 @@
+from .identity import get_identity
+
+class HeaderCounts(object):
+	"""
+	Cart and pending order counts shown in the page header.
+
+	Both numbers come from one query, run the first time a template asks
+	for either of them and reused for the rest of the request.
+	"""
+
+	def __init__(self, request):
+		self.identity = get_identity(request)
+
+	@property
+	def cart(self):
+		return self.identity.items_in_cart
+
+	@property
+	def order(self):
+		return self.identity.items_in_order
+
+def header_counts(request):
+	return {'header_counts': HeaderCounts(request)}
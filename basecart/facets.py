@@ -0,0 +1,92 @@
+import bisect
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Product,ProductFacet
+from . import productcache
+
+# lower bounds of the cost buckets, the last one is open ended
+COST_BUCKETS = getattr(settings, 'FACET_COST_BUCKETS', [0, 500, 1000, 5000, 10000, 50000])
+
+def cost_bucket(cost):
+	return COST_BUCKETS[max(0, bisect.bisect_right(COST_BUCKETS, cost)-1)]
+
+def cost_bucket_expression():
+	whens = [When(cost__gte=bound, then=Value(bound)) for bound in reversed(COST_BUCKETS)]
+	return Case(*whens, default=Value(COST_BUCKETS[0]), output_field=IntegerField())
+
+def facet_counts(queryset):
+	"""
+	{(kind, value): count} for the products in queryset, two GROUP BY queries.
+	"""
+	counts = {}
+	for row in queryset.order_by().values('category').annotate(count=Count('id')):
+		counts[(ProductFacet.Category, row['category'])] = row['count']
+	for row in queryset.order_by().annotate(bucket=cost_bucket_expression()).values('bucket').annotate(count=Count('id')):
+		counts[(ProductFacet.Cost, row['bucket'])] = row['count']
+	return counts
+
+def rebuild():
+	with transaction.atomic():
+		ProductFacet.objects.all().delete()
+		ProductFacet.objects.bulk_create([
+			ProductFacet(kind=kind, value=value, count=count)
+			for (kind, value), count in facet_counts(Product.objects.all()).items()])
+	productcache.invalidate('facets')
+
+def bump(kind, value, delta):
+	if not ProductFacet.objects.filter(kind=kind, value=value).update(count=F('count')+delta):
+		try:
+			with transaction.atomic():
+				ProductFacet.objects.create(kind=kind, value=value, count=delta)
+		except IntegrityError:
+			# created by a concurrent save in the meantime
+			ProductFacet.objects.filter(kind=kind, value=value).update(count=F('count')+delta)
+
+def facet_keys(category, cost):
+	return [(ProductFacet.Category, int(category)), (ProductFacet.Cost, cost_bucket(int(cost)))]
+
+def load_facets():
+	categories = dict(Product.CATEGORIES)
+	facets = {'categories':[], 'cost':[]}
+	for facet in ProductFacet.objects.filter(count__gt=0).order_by('kind','value'):
+		if facet.kind == ProductFacet.Category:
+			facets['categories'].append({'category':facet.value, 'name':categories.get(facet.value, ''), 'count':facet.count})
+		else:
+			position = COST_BUCKETS.index(facet.value) if facet.value in COST_BUCKETS else len(COST_BUCKETS)
+			upper = COST_BUCKETS[position+1]-1 if position+1 < len(COST_BUCKETS) else None
+			facets['cost'].append({'min':facet.value, 'max':upper, 'count':facet.count})
+	return facets
+
+def get_facets():
+	return productcache.get_or_load('facets:%s' % productcache.version('facets'), load_facets)
+
+@receiver(pre_save, sender=Product)
+def remember_facets(sender, instance, **kwargs):
+	instance._old_facets = None
+	if instance.pk is not None:
+		old = Product.objects.filter(pk=instance.pk).values_list('category','cost').first()
+		if old is not None:
+			instance._old_facets = facet_keys(*old)
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+	old = getattr(instance, '_old_facets', None) or []
+	new = facet_keys(instance.category, instance.cost)
+	if old == new:
+		return
+	for kind, value in old:
+		if (kind, value) not in new:
+			bump(kind, value, -1)
+	for kind, value in new:
+		if (kind, value) not in old:
+			bump(kind, value, 1)
+	productcache.invalidate('facets')
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+	for kind, value in facet_keys(instance.category, instance.cost):
+		bump(kind, value, -1)
+	productcache.invalidate('facets')
@@ -0,0 +1,71 @@
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import CartUser,Cart,Order
+
+def count_subquery(queryset):
+	counts = queryset.filter(user=OuterRef('pk')).order_by().values('user').annotate(count=Count('id')).values('count')
+	return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+class Identity(object):
+	"""
+	The signed in user and what pages ask about them, shared by the views,
+	context processors and template tags of one request.
+
+	The user is the CartUser the authentication middleware already loaded,
+	nothing here fetches it again. Header counts are read with one query
+	the first time anything asks for them.
+	"""
+
+	def __init__(self, request):
+		self.request = request
+		self._counts = None
+
+	@property
+	def user(self):
+		user = getattr(self.request, 'user', None)
+		if user is not None and user.is_authenticated:
+			return user
+		return None
+
+	@property
+	def is_authenticated(self):
+		return self.user is not None
+
+	def is_user(self, userid):
+		return self.user is not None and str(self.user.id) == str(userid)
+
+	@property
+	def address(self):
+		return self.user.address if self.user is not None else ''
+
+	def set_address(self, address):
+		CartUser.objects.filter(id=self.user.id).update(address=address)
+		self.user.address = address
+
+	def counts(self):
+		if self._counts is None:
+			counts = (0, 0)
+			if self.user is not None:
+				row = CartUser.objects.filter(id=self.user.id).annotate(
+					items_in_cart=count_subquery(Cart.objects.filter(status=Cart.Inorder)),
+					items_in_order=count_subquery(Order.objects.filter(status=Order.Notplaced)),
+					).values_list('items_in_cart','items_in_order').first()
+				if row is not None:
+					counts = row
+			self._counts = counts
+		return self._counts
+
+	@property
+	def items_in_cart(self):
+		return self.counts()[0]
+
+	@property
+	def items_in_order(self):
+		return self.counts()[1]
+
+def get_identity(request):
+	identity = getattr(request, '_identity', None)
+	if identity is None:
+		identity = Identity(request)
+		request._identity = identity
+	return identity
@@ -0,0 +1,128 @@
+import io
+import json
+import hashlib
+import logging
+import posixpath
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from kombu.exceptions import OperationalError
+from .models import Product
+from . import productcache
+
+# name -> (width, height, crop), crop fills the box exactly, otherwise the
+# image is only shrunk to fit inside it
+VARIANTS = getattr(settings, 'PRODUCT_IMAGE_VARIANTS', {
+	'thumb': (150, 150, True),
+	'card': (360, 360, True),
+	'web': (1200, 1200, False),
+})
+JPEG_QUALITY = getattr(settings, 'PRODUCT_IMAGE_QUALITY', 82)
+QUEUE = getattr(settings, 'PRODUCT_IMAGE_QUEUE', True)
+
+logger = logging.getLogger(__name__)
+
+def variants(product):
+	try:
+		return json.loads(product.photo_variants or '{}')
+	except ValueError:
+		return {}
+
+def photo_url(product, variant):
+	"""
+	URL of a resized copy of the product photo, the original until the
+	copies have been made.
+	"""
+	if not product.photo:
+		return ''
+	made = variants(product)
+	if made.get('source') == product.photo.name and variant in made:
+		return default_storage.url(made[variant])
+	return product.photo.url
+
+def content_hash(photo):
+	digest = hashlib.sha1()
+	photo.open('rb')
+	try:
+		for chunk in photo.chunks():
+			digest.update(chunk)
+	finally:
+		photo.close()
+	return digest.hexdigest()[:16]
+
+def render(image, width, height, crop):
+	from PIL import Image, ImageOps
+	if crop:
+		image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+	else:
+		image = image.copy()
+		image.thumbnail((width, height), Image.LANCZOS)
+	output = io.BytesIO()
+	image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+	return output.getvalue()
+
+def make_variants(photo):
+	"""
+	Writes every variant of photo next to it and returns their names. The
+	names carry a hash of the original, so a copy made from the same bytes
+	is reused and a replaced photo never shows an old copy. The copies go
+	to the default storage, they are derived data and not reference
+	counted like the photos.
+	"""
+	from PIL import Image
+	storage = default_storage
+	stem = posixpath.splitext(photo.name)[0]
+	digest = content_hash(photo)
+	made = {'source':photo.name}
+	image = None
+	try:
+		for variant, (width, height, crop) in sorted(VARIANTS.items()):
+			name = '%s.%s.%s.jpg' % (stem, variant, digest)
+			if not storage.exists(name):
+				if image is None:
+					photo.open('rb')
+					image = Image.open(photo)
+					image.load()
+					if image.mode != 'RGB':
+						image = image.convert('RGB')
+				name = storage.save(name, ContentFile(render(image, width, height, crop)))
+			made[variant] = name
+	finally:
+		photo.close()
+	return made
+
+def process_product_image(product_id):
+	product = Product.objects.filter(pk=product_id).only('id','photo','photo_variants').first()
+	if product is None or not product.photo:
+		return None
+	made = make_variants(product.photo)
+	# skipped when the photo was replaced meanwhile, its own task does that one
+	if Product.objects.filter(pk=product_id, photo=product.photo.name).update(photo_variants=json.dumps(made)):
+		productcache.invalidate_product(product_id)
+	return made
+
+def queue_photo_variants(ids):
+	"""
+	Sends one make_photo_variants task per product and returns how many went
+	out. When the broker is down the rest are logged and skipped rather than
+	holding up the request, processimages makes them later.
+	"""
+	if not QUEUE:
+		return 0
+	from .tasks import make_photo_variants
+	ids = list(ids)
+	for sent, pk in enumerate(ids):
+		try:
+			make_photo_variants.apply_async((pk,), retry=False)
+		except OperationalError as e:
+			logger.warning('could not queue photo variants of %d products: %s', len(ids)-sent, e)
+			return sent
+	return len(ids)
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+	if instance.photo and variants(instance).get('source') != instance.photo.name:
+		transaction.on_commit(lambda: queue_photo_variants([instance.pk]))
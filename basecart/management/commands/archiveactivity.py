@@ -0,0 +1,34 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from basecart.models import CartActivityLogger,CartActivityLogArchive
+
+FIELDS = ('username','email','action','product','comments','date_and_time')
+
+class Command(BaseCommand):
+	help = ('Moves activity log entries older than --days into the archive table, '
+		'or deletes them with --prune, so the live log table stays small.')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--days', type=int, default=90, help='entries newer than this stay in the live table')
+		parser.add_argument('--prune', action='store_true', help='delete old entries instead of archiving them')
+		parser.add_argument('--batch-size', type=int, default=5000, help='rows moved per transaction')
+
+	def handle(self, *args, **options):
+		cutoff = timezone.now()-timedelta(days=options['days'])
+		old = CartActivityLogger.objects.filter(date_and_time__lt=cutoff)
+		moved = 0
+		while True:
+			# short transactions so the consumer is never blocked for long
+			with transaction.atomic():
+				rows = list(old.order_by('date_and_time','id').values('id', *FIELDS)[:options['batch_size']])
+				if not rows:
+					break
+				if not options['prune']:
+					CartActivityLogArchive.objects.bulk_create([
+						CartActivityLogArchive(**dict((field, row[field]) for field in FIELDS))
+						for row in rows])
+				CartActivityLogger.objects.filter(id__in=[row['id'] for row in rows]).delete()
+			moved += len(rows)
+		self.stdout.write('%s %d entries older than %s' % ('deleted' if options['prune'] else 'archived', moved, cutoff))
@@ -0,0 +1,34 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from basecart import rollups
+from basecart.models import Order, SalesRollup
+
+class Command(BaseCommand):
+	help = ('Recomputes the hourly and daily sales rollups from the order table, '
+		'a few days per transaction, then moves the high-water mark to the newest order.')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--since', help='first day to rebuild, defaults to the oldest order')
+		parser.add_argument('--days', type=int, default=7, help='days rebuilt per transaction')
+
+	def handle(self, *args, **options):
+		now = timezone.now()
+		if options['since']:
+			try:
+				start = rollups.parse_moment(options['since'])
+			except ValueError as e:
+				raise CommandError(str(e))
+		else:
+			start = Order.objects.aggregate(first=Min('order_date'))['first']
+			if start is None:
+				self.stdout.write('no orders to roll up')
+				return
+		start = rollups.floor_day(start)
+		while start <= now:
+			end = min(start+timedelta(days=max(1, options['days'])-1), now)
+			start = rollups.rebuild(start, end)[1]
+			self.stdout.write('rolled up orders before %s' % start)
+		rollups.update_rollups(now)
+		self.stdout.write('%d rollup rows' % SalesRollup.objects.count())
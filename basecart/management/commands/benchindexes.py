@@ -0,0 +1,119 @@
+import time
+import random
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from importlib import import_module
+from basecart.models import CartUser,Product,Cart,Order,CartActivityLogger
+
+lookup_indexes = import_module('basecart.migrations.0003_lookup_indexes')
+
+class Rollback(Exception):
+	pass
+
+class Command(BaseCommand):
+	help = ('Seeds a large dataset inside a transaction and reports query plan costs and timings '
+		'for the hot lookups with and without the lookup indexes and the unique cart (user, product) '
+		'constraint. Everything, including the '
+		'seeded rows, is rolled back at the end. Index drops lock the tables, so only run this '
+		'against a development database.')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--rows', type=int, default=200000, help='orders, cart and log rows to seed')
+		parser.add_argument('--repeat', type=int, default=20, help='runs per query for the timing')
+
+	def handle(self, *args, **options):
+		if connection.vendor != 'postgresql':
+			raise CommandError('query plans are only reported for PostgreSQL')
+		self.repeat = options['repeat']
+		try:
+			with transaction.atomic():
+				self.seed(options['rows'])
+				with connection.cursor() as cursor:
+					cursor.execute('ANALYZE')
+				after = self.measure()
+				with transaction.atomic():
+					self.drop_indexes()
+					before = self.measure()
+					transaction.set_rollback(True)
+				self.report(before, after)
+				raise Rollback()
+		except Rollback:
+			pass
+
+	def seed(self, rows):
+		self.stdout.write('seeding %d rows' % rows)
+		users = CartUser.objects.bulk_create([
+			CartUser(username='bench-%d' % i, email='bench-%d@example.com' % i)
+			for i in range(max(1, rows//100))], batch_size=1000)
+		products = Product.objects.bulk_create([
+			Product(name='bench product %d' % i, cost=random.randint(1, 5000), stock=100,
+				photo='productimage/bench.jpg', category=random.randint(1, 5), created_by=random.choice(users))
+			for i in range(max(1, rows//10))], batch_size=1000)
+		# a user has one cart line per product, so the pairs are drawn without repeats
+		pairs = random.sample(range(len(users)*len(products)), min(rows, len(users)*len(products)))
+		Cart.objects.bulk_create([
+			Cart(user=users[pair//len(products)], product=products[pair%len(products)],
+				status=random.choice([Cart.Incart, Cart.Inorder]))
+			for pair in pairs], batch_size=5000)
+		Order.objects.bulk_create([
+			Order(user=random.choice(users), product=random.choice(products),
+				status=random.choice([Order.Placed, Order.Notplaced, Order.Cancelled]))
+			for i in range(rows)], batch_size=5000)
+		now = timezone.now()
+		CartActivityLogger.objects.bulk_create([
+			CartActivityLogger(username='bench', email='bench@example.com', action=CartActivityLogger.Addedtocart,
+				product='bench', date_and_time=now-timedelta(seconds=i))
+			for i in range(rows)], batch_size=5000)
+		# auto_now_add stamps every order with now, spread them over the past month
+		with connection.cursor() as cursor:
+			cursor.execute("UPDATE basecart_order SET order_date = now() - (id % 720) * interval '1 hour'")
+		self.user = users[len(users)//2]
+		self.product = products[len(products)//2]
+
+	def queries(self):
+		end = timezone.now()
+		start = end-timedelta(hours=1)
+		return [
+			('cart by user, status', Cart.objects.filter(user=self.user, status=Cart.Inorder)),
+			('cart by user, product', Cart.objects.filter(user=self.user, product=self.product)),
+			('orders by user, status', Order.objects.filter(user=self.user, status=Order.Notplaced)),
+			('orders by user, product, status', Order.objects.filter(user=self.user, product=self.product, status=Order.Notplaced)),
+			('orders in the past hour', Order.objects.filter(order_date__gte=start, order_date__lte=end)),
+			('latest activity log', CartActivityLogger.objects.order_by('-date_and_time')[:50]),
+		]
+
+	def measure(self):
+		results = {}
+		with connection.cursor() as cursor:
+			for name, queryset in self.queries():
+				sql, params = queryset.query.sql_with_params()
+				cursor.execute('EXPLAIN (FORMAT JSON) '+sql, params)
+				plan = cursor.fetchone()[0][0]['Plan']
+				timings = []
+				for i in range(self.repeat):
+					started = time.perf_counter()
+					cursor.execute(sql, params)
+					cursor.fetchall()
+					timings.append(time.perf_counter()-started)
+				timings.sort()
+				results[name] = (plan['Total Cost'], plan['Node Type'], timings[len(timings)//2]*1000)
+		return results
+
+	def drop_indexes(self):
+		with connection.schema_editor() as schema_editor:
+			for model in (Cart, Order, CartActivityLogger):
+				for index in model._meta.indexes:
+					schema_editor.remove_index(model, index)
+			# the unique (user, product) constraint is what serves cart lookups by user and product
+			schema_editor.alter_unique_together(Cart, Cart._meta.unique_together, [])
+			lookup_indexes.drop_partial_indexes(None, schema_editor)
+
+	def report(self, before, after):
+		self.stdout.write('%-34s %24s %24s' % ('query', 'without indexes', 'with indexes'))
+		for name, queryset in self.queries():
+			cells = []
+			for cost, node, ms in (before[name], after[name]):
+				cells.append('%10.1f %8.2fms' % (cost, ms))
+			self.stdout.write('%-34s %24s %24s  (%s -> %s)' % (name, cells[0], cells[1], before[name][1], after[name][1]))
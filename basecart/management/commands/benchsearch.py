@@ -0,0 +1,62 @@
+import time
+import random
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from basecart.models import CartUser,Product
+from basecart.search import search_products, update_search_vector
+
+WORDS = ('lamp','desk','phone','charger','cable','shirt','cotton','sofa','chair','table','lego',
+	'puzzle','novel','cookbook','kettle','steel','wooden','wireless','kids','leather','travel','smart')
+
+class Rollback(Exception):
+	pass
+
+class Command(BaseCommand):
+	help = ('Seeds a large catalog inside a transaction and compares ranked full text search '
+		'with a naive icontains scan. The seeded rows are rolled back at the end.')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--products', type=int, default=100000, help='products to seed')
+		parser.add_argument('--repeat', type=int, default=20, help='runs per query for the timing')
+
+	def handle(self, *args, **options):
+		if connection.vendor != 'postgresql':
+			raise CommandError('full text search needs PostgreSQL')
+		try:
+			with transaction.atomic():
+				self.seed(options['products'])
+				for query in ('lamp', 'wireless phone charger', 'wooden kids puzzle'):
+					search = self.time(options['repeat'], lambda: search_products(query))
+					naive = self.time(options['repeat'], lambda: list(self.naive(query)))
+					self.stdout.write('%-28s full text %8.2fms   icontains %8.2fms' % (query, search, naive))
+				raise Rollback()
+		except Rollback:
+			pass
+
+	def naive(self, query):
+		condition = Q()
+		for word in query.split():
+			condition &= Q(name__icontains=word) | Q(description__icontains=word)
+		return Product.objects.for_listing().filter(condition)[:200]
+
+	def time(self, repeat, run):
+		timings = []
+		for i in range(repeat):
+			started = time.perf_counter()
+			run()
+			timings.append(time.perf_counter()-started)
+		timings.sort()
+		return timings[len(timings)//2]*1000
+
+	def seed(self, count):
+		self.stdout.write('seeding %d products' % count)
+		seller = CartUser.objects.create(username='bench-search-seller')
+		Product.objects.bulk_create([
+			Product(name=' '.join(random.sample(WORDS, 3)), description=' '.join(random.choice(WORDS) for w in range(30)),
+				cost=random.randint(1, 5000), stock=10, photo='productimage/bench.jpg',
+				category=random.randint(1, 5), created_by=seller)
+			for i in range(count)], batch_size=5000)
+		update_search_vector(Product.objects.filter(created_by=seller))
+		with connection.cursor() as cursor:
+			cursor.execute('ANALYZE basecart_product')
@@ -0,0 +1,43 @@
+import time
+import random
+import tracemalloc
+from django.core.management.base import BaseCommand
+from basecart.searchindex import InvertedIndex
+from basecart.management.commands.benchsearch import WORDS
+
+class Command(BaseCommand):
+	help = ('Builds the in-process product search index from a synthetic catalog and reports '
+		'its memory use per thousand products and prefix query latency. Does not touch the database.')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--products', type=int, default=100000, help='synthetic products to index')
+		parser.add_argument('--repeat', type=int, default=1000, help='runs per query for the timing')
+
+	def handle(self, *args, **options):
+		count = options['products']
+		# extra made up words so the vocabulary looks like a real catalog
+		vocabulary = list(WORDS)+['%s%d' % (random.choice(WORDS), i) for i in range(count//10)]
+		products = [
+			(pk, ' '.join(random.sample(vocabulary, 3)), ' '.join(random.choice(vocabulary) for w in range(30)),
+				random.randint(1, 5), random.randint(1, 5000))
+			for pk in range(1, count+1)]
+
+		tracemalloc.start()
+		started = time.perf_counter()
+		index = InvertedIndex()
+		index.build(products)
+		built = time.perf_counter()-started
+		used = tracemalloc.get_traced_memory()[0]
+		tracemalloc.stop()
+		self.stdout.write('indexed %d products, %d terms in %.2fs' % (count, len(index.terms), built))
+		self.stdout.write('memory: %.1f MB total, %.1f KB per 1000 products' % (used/1024.0/1024, used/1024.0/(count/1000.0)))
+
+		for query in ('la', 'lam', 'desk lamp', 'wireless pho', 'wooden kids puz'):
+			timings = []
+			for i in range(options['repeat']):
+				started = time.perf_counter()
+				index.search(query, limit=10)
+				timings.append(time.perf_counter()-started)
+			timings.sort()
+			self.stdout.write('%-18s median %8.1fus  p99 %8.1fus' % (
+				query, timings[len(timings)//2]*1e6, timings[int(len(timings)*0.99)]*1e6))
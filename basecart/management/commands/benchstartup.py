@@ -0,0 +1,48 @@
+import sys
+import json
+import subprocess
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# runs in a fresh interpreter so nothing is already imported or connected
+SCRIPT = '''
+import os, sys, json, time
+started = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'qbcart.settings')
+from django.db import connection
+queries = []
+def count(execute, sql, params, many, context):
+	queries.append(sql)
+	return execute(sql, params, many, context)
+with connection.execute_wrapper(count):
+	import django
+	django.setup()
+	setup = time.perf_counter()
+	for module in sys.argv[1:]:
+		__import__(module)
+print(json.dumps({'setup':setup-started, 'imports':time.perf_counter()-setup, 'queries':queries}))
+'''
+
+MODULES = ('qbcart.urls', 'basecart.tasks', 'qbcart.wsgi')
+
+class Command(BaseCommand):
+	help = ('Starts fresh interpreters that set up django and import the url conf, views and tasks '
+		'the way a web or celery worker does, and reports the cold start time and the queries run while importing.')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--runs', type=int, default=5, help='interpreters to start')
+		parser.add_argument('modules', nargs='*', help='modules to import, defaults to %s' % ' '.join(MODULES))
+
+	def handle(self, *args, **options):
+		modules = options['modules'] or list(MODULES)
+		results = []
+		for i in range(max(1, options['runs'])):
+			output = subprocess.check_output([sys.executable, '-c', SCRIPT]+modules, cwd=settings.BASE_DIR)
+			results.append(json.loads(output.decode('utf8').strip().splitlines()[-1]))
+		for name in ('setup', 'imports'):
+			timings = sorted(result[name] for result in results)
+			self.stdout.write('%-8s median %.1f ms  min %.1f ms' % (name, timings[len(timings)//2]*1000, timings[0]*1000))
+		queries = results[-1]['queries']
+		self.stdout.write('%d queries during startup' % len(queries))
+		for sql in queries:
+			self.stdout.write('  '+sql)
@@ -0,0 +1,50 @@
+import json
+from django.core.management.base import BaseCommand
+from basecart import images, productcache
+from basecart.models import Product
+from basecart.storage import photo_storage, is_blob_name
+
+class Command(BaseCommand):
+	help = ('Moves product photos saved before the content addressed storage into it, so '
+		'identical photos share one file. With --delete the old files are removed afterwards.')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--delete', action='store_true', help='remove the old files once no product uses them')
+
+	def handle(self, *args, **options):
+		moved = {}
+		products_moved = 0
+		missing = 0
+		products = Product.objects.exclude(photo='').only('id','photo','photo_variants').order_by('id')
+		for product in products.iterator():
+			old = product.photo.name
+			if is_blob_name(old):
+				continue
+			if old in moved:
+				# shared by an earlier product, count one more user instead of hashing again
+				new = moved[old]
+				photo_storage.retain(new)
+			elif not photo_storage.exists(old):
+				missing += 1
+				self.stderr.write('product %s: %s is missing' % (product.id, old))
+				continue
+			else:
+				with photo_storage.open(old) as content:
+					new = photo_storage.save(old, content)
+			# the copies were made from the same bytes, they stay valid
+			made = images.variants(product)
+			if made.get('source') == old:
+				made['source'] = new
+			Product.objects.filter(id=product.id).update(photo=new, photo_variants=json.dumps(made) if made else '')
+			productcache.invalidate_product(product.id, catalog=False)
+			moved[old] = new
+			products_moved += 1
+		productcache.invalidate('catalog')
+		deleted = 0
+		if options['delete']:
+			for old in moved:
+				if not Product.objects.filter(photo=old).exists():
+					photo_storage.delete_legacy(old)
+					deleted += 1
+		self.stdout.write('moved %d photos into %d files, %d missing, %d old files deleted' % (
+			products_moved, len(set(moved.values())), missing, deleted))
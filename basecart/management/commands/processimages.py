@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from basecart.images import process_product_image, queue_photo_variants
+from basecart.models import Product
+
+class Command(BaseCommand):
+	help = ('Makes the thumbnail and web copies of product photos that do not have them yet, '
+		'in this process or, with --queue, through the celery workers.')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--all', action='store_true', help='redo products that already have copies')
+		parser.add_argument('--queue', action='store_true', help='send one task per product instead of working here')
+
+	def handle(self, *args, **options):
+		products = Product.objects.exclude(photo='')
+		if not options['all']:
+			products = products.filter(photo_variants='')
+		ids = list(products.order_by('id').values_list('id', flat=True))
+		if options['queue']:
+			self.stdout.write('queued %d of %d products' % (queue_photo_variants(ids), len(ids)))
+			return
+		failed = 0
+		for done, pk in enumerate(ids, 1):
+			try:
+				process_product_image(pk)
+			except (IOError, OSError) as e:
+				failed += 1
+				self.stderr.write('product %s: %s' % (pk, e))
+			if done % 100 == 0:
+				self.stdout.write('%d/%d' % (done, len(ids)))
+		self.stdout.write('processed %d products, %d failed' % (len(ids)-failed, failed))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from basecart import facets
+from basecart.models import ProductFacet
+
+class Command(BaseCommand):
+	help = 'Recounts the product category and cost facets from scratch.'
+
+	def handle(self, *args, **options):
+		facets.rebuild()
+		self.stdout.write('rebuilt %d facets' % ProductFacet.objects.count())
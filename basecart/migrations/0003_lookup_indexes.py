@@ -0,0 +1,59 @@
+from django.db import migrations, models
+
+# Partial indexes for the rows the storefront reads on every page: the
+# cart lines a user is about to order and their pending orders. Django 2.0
+# can not declare partial indexes on a model, so they are created with raw
+# SQL and only on PostgreSQL.
+PARTIAL_INDEXES = [
+    ('cart_inorder_user_idx', 'basecart_cart', 'user_id', "status = 'IO'"),
+    ('order_notplaced_user_idx', 'basecart_order', 'user_id', "status = 'NP'"),
+]
+
+
+def create_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column, condition in PARTIAL_INDEXES:
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s) WHERE %s' % (name, table, column, condition))
+
+
+def drop_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, column, condition in PARTIAL_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basecart', '0002_auto_20180830_1156'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['user', 'status'], name='cart_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['user', 'product'], name='cart_user_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'product', 'status'], name='order_user_product_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['order_date'], name='order_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cartactivitylogger',
+            index=models.Index(fields=['date_and_time'], name='activity_date_and_time_idx'),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
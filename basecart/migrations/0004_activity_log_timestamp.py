@@ -0,0 +1,80 @@
+from datetime import datetime
+from django.db import migrations, models
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+def parse_timestamps(apps, schema_editor):
+    CartActivityLogger = apps.get_model('basecart', 'CartActivityLogger')
+    # the strings were written in local time by create_json
+    tz = timezone.get_default_timezone()
+    unknown = timezone.make_aware(datetime(1970, 1, 1), timezone.utc)
+    for log in CartActivityLogger.objects.only('id', 'date_and_time').iterator():
+        parsed = parse_datetime(log.date_and_time.strip())
+        if parsed is None:
+            parsed = unknown
+        elif timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, tz)
+        CartActivityLogger.objects.filter(id=log.id).update(logged_at=parsed)
+
+
+def format_timestamps(apps, schema_editor):
+    CartActivityLogger = apps.get_model('basecart', 'CartActivityLogger')
+    tz = timezone.get_default_timezone()
+    for log in CartActivityLogger.objects.only('id', 'logged_at').iterator():
+        value = timezone.localtime(log.logged_at, tz).strftime('%Y-%m-%d %H:%M')
+        CartActivityLogger.objects.filter(id=log.id).update(date_and_time=value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basecart', '0003_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='cartactivitylogger',
+            name='activity_date_and_time_idx',
+        ),
+        migrations.AddField(
+            model_name='cartactivitylogger',
+            name='logged_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(parse_timestamps, format_timestamps),
+        migrations.RemoveField(
+            model_name='cartactivitylogger',
+            name='date_and_time',
+        ),
+        migrations.RenameField(
+            model_name='cartactivitylogger',
+            old_name='logged_at',
+            new_name='date_and_time',
+        ),
+        migrations.AlterField(
+            model_name='cartactivitylogger',
+            name='date_and_time',
+            field=models.DateTimeField(default=timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='cartactivitylogger',
+            index=models.Index(fields=['date_and_time'], name='activity_date_and_time_idx'),
+        ),
+        migrations.CreateModel(
+            name='CartActivityLogArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=100)),
+                ('email', models.CharField(max_length=200)),
+                ('action', models.CharField(choices=[('PC', 'Product Created'), ('PU', 'Product Updated'), ('PD', 'Product Deleted'), ('AC', 'Added to Cart'), ('UC', 'Updated Cart'), ('RC', 'Removed from Cart'), ('MW', 'Moved to Wishlist'), ('OR', 'Order Created'), ('OP', 'Order Placed'), ('OC', 'Order Cancelled')], max_length=2)),
+                ('product', models.CharField(max_length=100)),
+                ('comments', models.TextField(blank=True)),
+                ('date_and_time', models.DateTimeField(default=timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='cartactivitylogarchive',
+            index=models.Index(fields=['date_and_time'], name='archive_date_and_time_idx'),
+        ),
+    ]
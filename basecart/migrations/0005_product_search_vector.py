@@ -0,0 +1,34 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # the GIN index and tsvector functions only exist on PostgreSQL
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.search import SearchVector
+    Product = apps.get_model('basecart', 'Product')
+    Product.objects.update(search_vector=SearchVector('name', weight='A', config='english')+SearchVector('description', weight='B', config='english'))
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS product_search_vector_idx ON basecart_product USING gin (search_vector)')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS product_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basecart', '0004_activity_log_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Value, When
+
+# cost buckets as basecart.facets defined them when this migration was written
+COST_BUCKETS = [0, 500, 1000, 5000, 10000, 50000]
+
+
+def count_products(apps, schema_editor):
+    Product = apps.get_model('basecart', 'Product')
+    ProductFacet = apps.get_model('basecart', 'ProductFacet')
+    products = Product.objects.order_by()
+    bucket = Case(
+        *[When(cost__gte=bound, then=Value(bound)) for bound in reversed(COST_BUCKETS)],
+        default=Value(COST_BUCKETS[0]), output_field=IntegerField())
+    facets = [
+        ProductFacet(kind='CT', value=row['category'], count=row['count'])
+        for row in products.values('category').annotate(count=Count('id'))]
+    facets += [
+        ProductFacet(kind='CO', value=row['bucket'], count=row['count'])
+        for row in products.annotate(bucket=bucket).values('bucket').annotate(count=Count('id'))]
+    ProductFacet.objects.bulk_create(facets)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basecart', '0005_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('CT', 'Category'), ('CO', 'Cost')], max_length=2)),
+                ('value', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='productfacet',
+            unique_together={('kind', 'value')},
+        ),
+        migrations.RunPython(count_products, migrations.RunPython.noop),
+    ]
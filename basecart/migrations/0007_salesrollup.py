@@ -0,0 +1,42 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basecart', '0006_productfacet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupMark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('order_id', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('H', 'Hourly'), ('D', 'Daily')], max_length=1)),
+                ('bucket', models.DateTimeField()),
+                ('dimension', models.CharField(choices=[('PR', 'Product'), ('SL', 'Seller'), ('CT', 'Category')], max_length=2)),
+                ('key', models.IntegerField()),
+                ('status', models.CharField(choices=[('PL', 'Placed'), ('NP', 'Notplaced'), ('CN', 'Cancelled')], max_length=2)),
+                ('orders', models.IntegerField(default=0)),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='salesrollup',
+            index=models.Index(fields=['period', 'dimension', 'bucket'], name='rollup_period_bucket_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='salesrollup',
+            unique_together={('period', 'bucket', 'dimension', 'key', 'status')},
+        ),
+    ]
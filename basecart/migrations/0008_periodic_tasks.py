@@ -0,0 +1,53 @@
+from django.db import migrations
+from django.utils import timezone
+
+# name, task, crontab, task name used before the tasks moved into basecart
+SCHEDULES = (
+    ('hourly_mail', 'basecart.tasks.send_hourly_email', {'minute': '0', 'hour': '*/1'}, 'tasks.send_hourly_email'),
+    ('sales_rollups', 'basecart.tasks.update_sales_rollups', {'minute': '*/10', 'hour': '*'}, 'tasks.update_sales_rollups'),
+)
+
+
+def crontab(CrontabSchedule, fields):
+    schedule = CrontabSchedule.objects.filter(**fields).first()
+    if schedule is None:
+        schedule = CrontabSchedule.objects.create(**fields)
+    return schedule
+
+
+def changed(apps):
+    # tells a running beat to reload its schedule
+    PeriodicTasks = apps.get_model('django_celery_beat', 'PeriodicTasks')
+    PeriodicTasks.objects.update_or_create(ident=1, defaults={'last_update': timezone.now()})
+
+
+def register_periodic_tasks(apps, schema_editor):
+    CrontabSchedule = apps.get_model('django_celery_beat', 'CrontabSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    for name, task, fields, old_task in SCHEDULES:
+        periodic, created = PeriodicTask.objects.get_or_create(
+            name=name, defaults={'task': task, 'crontab': crontab(CrontabSchedule, fields)})
+        # rows made by the old import time registration keep their schedule
+        if not created and periodic.task == old_task:
+            periodic.task = task
+            periodic.save()
+    changed(apps)
+
+
+def rename_back(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    for name, task, fields, old_task in SCHEDULES:
+        PeriodicTask.objects.filter(name=name, task=task).update(task=old_task)
+    changed(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basecart', '0007_salesrollup'),
+        ('django_celery_beat', '0006_auto_20180210_1226'),
+    ]
+
+    operations = [
+        migrations.RunPython(register_periodic_tasks, rename_back),
+    ]
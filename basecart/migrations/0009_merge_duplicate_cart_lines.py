@@ -0,0 +1,30 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # duplicates come from double submits of the same product, keep the
+    # oldest line with the largest quantity any of them had
+    Cart = apps.get_model('basecart', 'Cart')
+    duplicates = Cart.objects.values('user', 'product').annotate(lines=Count('id')).filter(lines__gt=1).order_by()
+    for group in list(duplicates):
+        lines = list(Cart.objects.filter(user=group['user'], product=group['product']).order_by('id'))
+        keep = lines[0]
+        keep.quantity = max(line.quantity for line in lines)
+        if any(line.status == 'IO' for line in lines):
+            keep.status = 'IO'
+        keep.save()
+        Cart.objects.filter(id__in=[line.id for line in lines[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basecart', '0008_periodic_tasks'),
+    ]
+
+    # on its own so the rows it changes are committed before 0010 alters
+    # the table, postgres refuses ALTER TABLE with pending trigger events
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def start_from_order_date(apps, schema_editor):
+    # existing orders count as last touched when they were made, so the next
+    # rollup run does not re-roll every day there ever was an order
+    Order = apps.get_model('basecart', 'Order')
+    Order.objects.update(updated=F('order_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basecart', '0012_content_addressed_photos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated'], name='order_updated_idx'),
+        ),
+        migrations.RunPython(start_from_order_date, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations, models
+from django.utils import timezone
+
+NAME = 'cart_requests'
+TASK = 'basecart.tasks.prune_cart_requests'
+CRONTAB = {'minute': '30', 'hour': '*'}
+
+
+def changed(apps):
+    # tells a running beat to reload its schedule
+    PeriodicTasks = apps.get_model('django_celery_beat', 'PeriodicTasks')
+    PeriodicTasks.objects.update_or_create(ident=1, defaults={'last_update': timezone.now()})
+
+
+def register_periodic_task(apps, schema_editor):
+    CrontabSchedule = apps.get_model('django_celery_beat', 'CrontabSchedule')
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    schedule = CrontabSchedule.objects.filter(**CRONTAB).first()
+    if schedule is None:
+        schedule = CrontabSchedule.objects.create(**CRONTAB)
+    PeriodicTask.objects.get_or_create(name=NAME, defaults={'task': TASK, 'crontab': schedule})
+    changed(apps)
+
+
+def remove_periodic_task(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(name=NAME, task=TASK).delete()
+    changed(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basecart', '0013_order_updated'),
+        ('django_celery_beat', '0006_auto_20180210_1226'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cartrequest',
+            index=models.Index(fields=['created'], name='cartrequest_created_idx'),
+        ),
+        migrations.RunPython(register_periodic_task, remove_periodic_task),
+    ]
@@ -1,5 +1,9 @@
 from django.db import models
+from django.db.models import F, Sum
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
+from .storage import photo_storage
 import random
 
 # Create your models here.
@@ -17,6 +21,15 @@ class CartUser(AbstractUser):
 	def __str__(self):
 		return self.username
 
+class ProductQuerySet(models.QuerySet):
+	def for_listing(self):
+		return self.only('id','name','cost','photo','photo_variants','category')
+
+	def with_seller(self):
+		return self.select_related('created_by').only(
+			'id','name','cost','stock','category',
+			'created_by__id','created_by__username')
+
 class Product(models.Model):
 	Electronics=1
 	Fasion=2
@@ -34,9 +47,23 @@ class Product(models.Model):
 	description = models.TextField(blank=True)
 	cost = models.PositiveIntegerField()
 	stock = models.PositiveIntegerField()
-	photo = models.ImageField(upload_to='productimage')
+	photo = models.ImageField(upload_to='productimage', storage=photo_storage)
+	# json {"source": photo name, variant: file name}, written by basecart.images
+	photo_variants = models.TextField(blank=True, default='', editable=False)
 	category = models.IntegerField(choices=CATEGORIES, default=Electronics)
 	created_by = models.ForeignKey(CartUser, on_delete=models.CASCADE)
+	# weighted name/description lexemes, kept up to date by basecart.search
+	search_vector = SearchVectorField(null=True, editable=False)
+
+	objects = ProductQuerySet.as_manager()
+
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		product = super(Product, cls).from_db(db, field_names, values)
+		# photo as loaded, basecart.storage releases it when it is replaced
+		if 'photo' in product.__dict__:
+			product._loaded_photo = product.__dict__['photo']
+		return product
 
 	def __str__(self):
 		return self.name
@@ -44,6 +71,43 @@ class Product(models.Model):
 	def set_product_key(self):
 		return random.randint(1,101)
 
+class LineTotalQuerySet(models.QuerySet):
+	def with_line_total(self):
+		return self.annotate(line_total=F('quantity')*F('product__cost'))
+
+	def total(self):
+		return self.aggregate(total=Sum(F('quantity')*F('product__cost')))['total'] or 0
+
+# product counts per category and per cost bucket, maintained by basecart.facets
+class ProductFacet(models.Model):
+	Category = 'CT'
+	Cost = 'CO'
+	KINDS = (
+		(Category,'Category'),
+		(Cost,'Cost'),
+		)
+	kind = models.CharField(max_length=2, choices=KINDS)
+	# category id, or the lower bound of the cost bucket
+	value = models.IntegerField()
+	count = models.IntegerField(default=0)
+
+	class Meta:
+		unique_together = ('kind','value')
+
+	def __str__(self):
+		return '%s %s' % (self.get_kind_display(), self.value)
+
+class CartQuerySet(LineTotalQuerySet):
+	def with_product(self):
+		return self.select_related('product').only(
+			'id','user','quantity','status','product_key',
+			'product__id','product__name','product__cost','product__photo','product__photo_variants')
+
+	def with_user_and_product(self):
+		return self.select_related('user','product').only(
+			'id','quantity','status',
+			'user__id','user__username','product__id','product__name')
+
 class Cart(models.Model):
 	Incart = 'IC'
 	Inorder = 'IO'
@@ -56,10 +120,30 @@ class Cart(models.Model):
 	quantity = models.PositiveIntegerField(default=1)
 	status = models.CharField(max_length=2, choices=STATUSES, default=Inorder)
 	product_key = models.PositiveIntegerField(default=0) 
+
+	objects = CartQuerySet.as_manager()
+
+	class Meta:
+		# one line per product, the unique index also serves user+product lookups
+		unique_together = ('user','product')
+		indexes = [
+			models.Index(fields=['user','status'], name='cart_user_status_idx'),
+		]
 	
 	def __str__(self):
 		return self.product.name
 
+class OrderQuerySet(LineTotalQuerySet):
+	def with_product(self):
+		return self.select_related('product').only(
+			'id','user','quantity','status','price','order_date',
+			'product__id','product__name','product__cost','product__photo','product__photo_variants')
+
+	def with_user_and_product(self):
+		return self.select_related('user','product').only(
+			'id','quantity','status','price','order_date',
+			'user__id','user__username','product__id','product__name')
+
 class Order(models.Model):
 	Placed = 'PL'
 	Notplaced = 'NP'
@@ -75,11 +159,23 @@ class Order(models.Model):
 	status = models.CharField(max_length=2, choices=STATUSES, default= Notplaced)
 	quantity = models.PositiveIntegerField(default=1)
 	price = models.PositiveIntegerField(default=0)
+	# last change, queryset updates set it by hand; basecart.rollups re-rolls the days of touched orders
+	updated = models.DateTimeField(auto_now=True)
+
+	objects = OrderQuerySet.as_manager()
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['user','status'], name='order_user_status_idx'),
+			models.Index(fields=['user','product','status'], name='order_user_product_status_idx'),
+			models.Index(fields=['order_date'], name='order_date_idx'),
+			models.Index(fields=['updated'], name='order_updated_idx'),
+		]
 	
 	def __str__(self):
 		return self.user.username
 
-class CartActivityLogger(models.Model):
+class ActivityLog(models.Model):
 	Productcreated ='PC'
 	Productupdated ='PU'
 	Productdeleted = 'PD'
@@ -109,7 +205,89 @@ class CartActivityLogger(models.Model):
 	action = models.CharField(max_length =2, choices=ACTIONS)
 	product = models.CharField(max_length = 100)
 	comments = models.TextField(blank=True)
-	date_and_time = models.CharField(max_length = 100)
+	date_and_time = models.DateTimeField(default=timezone.now)
+
+	class Meta:
+		abstract = True
 
 	def __str__(self):
-		return self.username
\ No newline at end of file
+		return self.username
+
+class CartActivityLogger(ActivityLog):
+	class Meta:
+		indexes = [
+			models.Index(fields=['date_and_time'], name='activity_date_and_time_idx'),
+		]
+
+# rows older than the retention period, moved here by the archiveactivity command
+class CartActivityLogArchive(ActivityLog):
+	class Meta:
+		indexes = [
+			models.Index(fields=['date_and_time'], name='archive_date_and_time_idx'),
+		]
+
+class SalesRollup(models.Model):
+	Hourly = 'H'
+	Daily = 'D'
+	PERIODS = (
+		(Hourly,'Hourly'),
+		(Daily,'Daily'),
+		)
+	Product = 'PR'
+	Seller = 'SL'
+	Category = 'CT'
+	DIMENSIONS = (
+		(Product,'Product'),
+		(Seller,'Seller'),
+		(Category,'Category'),
+		)
+	period = models.CharField(max_length=1, choices=PERIODS)
+	bucket = models.DateTimeField()
+	dimension = models.CharField(max_length=2, choices=DIMENSIONS)
+	# product id, seller id or category number depending on dimension
+	key = models.IntegerField()
+	status = models.CharField(max_length=2, choices=Order.STATUSES)
+	orders = models.IntegerField(default=0)
+	quantity = models.BigIntegerField(default=0)
+	revenue = models.BigIntegerField(default=0)
+
+	class Meta:
+		unique_together = ('period','bucket','dimension','key','status')
+		indexes = [
+			models.Index(fields=['period','dimension','bucket'], name='rollup_period_bucket_idx'),
+		]
+
+# responses of batch cart requests, replayed when a client retries with the same key
+class CartRequest(models.Model):
+	user = models.ForeignKey(CartUser, on_delete=models.CASCADE)
+	key = models.CharField(max_length=64)
+	# sha1 of the request body, a key reused for a different body is rejected
+	digest = models.CharField(max_length=40)
+	response = models.TextField(blank=True)
+	created = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		unique_together = ('user','key')
+		indexes = [
+			models.Index(fields=['created'], name='cartrequest_created_idx'),
+		]
+
+# how far basecart.rollups has read the order table
+class RollupMark(models.Model):
+	name = models.CharField(max_length=50, unique=True)
+	order_id = models.IntegerField(default=0)
+	updated = models.DateTimeField(null=True)
+
+	def __str__(self):
+		return self.name
+
+# one row per file kept by basecart.storage.ContentAddressedStorage
+class StoredBlob(models.Model):
+	name = models.CharField(max_length=255, unique=True)
+	# products using the file, it is removed from disk when this drops to 0
+	refs = models.IntegerField(default=0)
+	size = models.BigIntegerField(default=0)
+	created = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return self.name
@@ -0,0 +1,122 @@
+import json
+import base64
+import binascii
+from django.conf import settings
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+PAGE_SIZE = getattr(settings, 'API_PAGE_SIZE', 100)
+MAX_PAGE_SIZE = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+STREAM_CHUNK_SIZE = getattr(settings, 'API_STREAM_CHUNK_SIZE', 2000)
+
+class InvalidCursor(ValueError):
+	pass
+
+def encode_cursor(values):
+	return base64.urlsafe_b64encode(json.dumps(values, cls=JSONEncoder).encode('utf8')).decode('ascii')
+
+def decode_cursor(cursor):
+	try:
+		values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf8'))
+	except (ValueError, TypeError, UnicodeError, binascii.Error):
+		raise InvalidCursor('invalid cursor')
+	if not isinstance(values, list):
+		raise InvalidCursor('invalid cursor')
+	return values
+
+class KeysetPaginator(object):
+	"""
+	Cursor pagination over a unique ordering such as ('id',) or
+	('-order_date','-id').
+
+	The cursor holds the ordering values of the last row sent, so every
+	page is a plain indexed range scan no matter how deep the client
+	pages, unlike OFFSET which reads and throws away all earlier rows.
+	"""
+
+	def __init__(self, request, ordering):
+		self.request = request
+		self.ordering = ordering
+		self.next_cursor = None
+
+	def page_size(self):
+		try:
+			size = int(self.request.query_params.get('page_size', PAGE_SIZE))
+		except ValueError:
+			size = PAGE_SIZE
+		return max(1, min(size, MAX_PAGE_SIZE))
+
+	def after(self, queryset, values):
+		if len(values) != len(self.ordering):
+			raise InvalidCursor('invalid cursor')
+		condition = Q()
+		equal = {}
+		for field, value in zip(self.ordering, values):
+			name = field.lstrip('-')
+			try:
+				value = queryset.model._meta.get_field(name).to_python(value)
+			except Exception:
+				raise InvalidCursor('invalid cursor')
+			lookup = name+('__lt' if field.startswith('-') else '__gt')
+			condition |= Q(**equal) & Q(**{lookup:value})
+			equal[name] = value
+		return queryset.filter(condition)
+
+	def filter(self, queryset):
+		queryset = queryset.order_by(*self.ordering)
+		cursor = self.request.query_params.get('cursor')
+		if cursor:
+			queryset = self.after(queryset, decode_cursor(cursor))
+		return queryset
+
+	def paginate(self, queryset):
+		size = self.page_size()
+		rows = list(self.filter(queryset)[:size+1])
+		if len(rows) > size:
+			last = rows[size-1]
+			self.next_cursor = encode_cursor([getattr(last, field.lstrip('-')) for field in self.ordering])
+		return rows[:size]
+
+def stream(queryset, serializer_class, extra=None):
+	# rows are read with a server side cursor and written out as they are serialized
+	def generate():
+		yield '{"data":['
+		separator = ''
+		for obj in queryset.iterator(chunk_size=STREAM_CHUNK_SIZE):
+			yield separator+json.dumps(serializer_class(obj).data, cls=JSONEncoder)
+			separator = ','
+		tail = dict(extra or {}, status='ok', error='')
+		yield '],'+json.dumps(tail, cls=JSONEncoder)[1:]
+	return StreamingHttpResponse(generate(), content_type='application/json')
+
+def list_response(request, queryset, serializer_class, ordering, extra=None, cache=None):
+	"""
+	Paginated list in the usual {'data','status','error'} envelope, the
+	cursor of the next page is sent in the X-Next-Cursor header. With
+	?stream=1 everything after the cursor is streamed as one document.
+
+	cache, if given, is called with a loader returning (data, next_cursor)
+	for the requested page and returns that pair, possibly from a cache.
+	"""
+	paginator = KeysetPaginator(request, ordering)
+
+	def load():
+		rows = paginator.paginate(queryset)
+		return list(serializer_class(rows, many=True).data), paginator.next_cursor
+
+	try:
+		if request.query_params.get('stream'):
+			return stream(paginator.filter(queryset), serializer_class, extra)
+		if cache is not None:
+			data, next_cursor = cache(load)
+		else:
+			data, next_cursor = load()
+	except InvalidCursor as e:
+		return Response({'error':str(e),'status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
+	response = Response(dict(extra or {}, data=data, status='ok', error=''),status=status.HTTP_200_OK)
+	if next_cursor:
+		response['X-Next-Cursor'] = next_cursor
+	return response
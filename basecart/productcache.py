@@ -0,0 +1,155 @@
+import time
+import hashlib
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Product
+from .pagination import PAGE_SIZE
+
+CACHE_ALIAS = getattr(settings, 'PRODUCT_CACHE_ALIAS', 'products')
+# entries older than SOFT_TTL are refreshed by one caller while the rest keep serving them
+SOFT_TTL = getattr(settings, 'PRODUCT_CACHE_SOFT_TTL', 300)
+HARD_TTL = getattr(settings, 'PRODUCT_CACHE_HARD_TTL', 3600)
+# product list pages cached from the start of the list
+CACHED_PAGES = getattr(settings, 'PRODUCT_CACHE_PAGES', 10)
+LOCK_TTL = 30
+# how long a caller waits for somebody else's load on a cold key before loading itself
+WAIT_STEPS = 10
+WAIT_STEP = 0.05
+
+_counters = {'hits':0, 'misses':0, 'stale':0, 'loads':0}
+_counters_lock = threading.Lock()
+
+def get_cache():
+	if CACHE_ALIAS in settings.CACHES:
+		return caches[CACHE_ALIAS]
+	return caches['default']
+
+def count(name):
+	with _counters_lock:
+		_counters[name] += 1
+
+def cache_stats():
+	with _counters_lock:
+		return dict(_counters)
+
+def version(name):
+	cache = get_cache()
+	value = cache.get('version:'+name)
+	if value is None:
+		cache.add('version:'+name, 1, None)
+		value = cache.get('version:'+name, 1)
+	return value
+
+def invalidate(name):
+	# bumping the version orphans every key built from it, including ones a
+	# slow loader is about to write with data read before the change
+	cache = get_cache()
+	try:
+		cache.incr('version:'+name)
+	except ValueError:
+		cache.set('version:'+name, 2, None)
+
+def get_or_load(key, load):
+	cache = get_cache()
+	entry = cache.get(key)
+	if entry is not None:
+		value, fresh_until = entry
+		if time.time() < fresh_until:
+			count('hits')
+			return value
+		count('stale')
+		if not cache.add(key+':lock', 1, LOCK_TTL):
+			return value
+	else:
+		count('misses')
+		if not cache.add(key+':lock', 1, LOCK_TTL):
+			for i in range(WAIT_STEPS):
+				time.sleep(WAIT_STEP)
+				entry = cache.get(key)
+				if entry is not None:
+					return entry[0]
+			return load()
+	try:
+		value = load()
+		count('loads')
+		cache.set(key, (value, time.time()+SOFT_TTL), HARD_TTL)
+	finally:
+		cache.delete(key+':lock')
+	return value
+
+def product_record(product, fields=None):
+	record = {}
+	for field in Product._meta.concrete_fields:
+		if field.name == 'search_vector' or (fields is not None and field.name not in fields):
+			continue
+		value = getattr(product, field.attname)
+		if isinstance(field, models.FileField):
+			value = value.name
+		record[field.attname] = value
+	return record
+
+def as_product(record):
+	return Product.from_db('default', list(record), list(record.values()))
+
+def get_product(pk):
+	"""
+	Cached record of one product, None if it does not exist.
+	"""
+	def load():
+		product = Product.objects.filter(pk=pk).first()
+		return product_record(product) if product is not None else None
+	return get_or_load('product:%s:%s' % (pk, version('product:%s' % pk)), load)
+
+CATALOG_FIELDS = ('id','name','cost','photo','photo_variants','category')
+
+def get_catalog():
+	"""
+	Cached records of every product with the fields listing pages show.
+	"""
+	def load():
+		return [product_record(product, CATALOG_FIELDS) for product in Product.objects.only(*CATALOG_FIELDS).order_by('id')]
+	return get_or_load('catalog:%s' % version('catalog'), load)
+
+def page_key(catalog_version, cursor):
+	page = hashlib.md5(cursor.encode('utf8')).hexdigest() if cursor else 'first'
+	return 'catalog:%s:page:%s' % (catalog_version, page)
+
+def get_catalog_page(cursor, page_size, load):
+	"""
+	(data, next_cursor) of a product list page, load returns the same.
+
+	Only the first CACHED_PAGES pages at the default page size are cached,
+	reached through cursors handed out by those pages. Any other cursor or
+	page size is loaded directly, so clients can not fill the cache with
+	keys of their own.
+	"""
+	if page_size not in (None, '', str(PAGE_SIZE)):
+		return load()
+	cache = get_cache()
+	catalog_version = version('catalog')
+	depth = 0
+	if cursor:
+		depth = cache.get(page_key(catalog_version, cursor)+':depth')
+		if depth is None:
+			return load()
+
+	def load_page():
+		data, next_cursor = load()
+		if next_cursor and depth+1 < CACHED_PAGES:
+			cache.set(page_key(catalog_version, next_cursor)+':depth', depth+1, HARD_TTL)
+		return data, next_cursor
+	return get_or_load(page_key(catalog_version, cursor), load_page)
+
+def invalidate_product(pk, catalog=True):
+	invalidate('product:%s' % pk)
+	if catalog:
+		invalidate('catalog')
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+	invalidate_product(instance.pk)
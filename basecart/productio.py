@@ -0,0 +1,167 @@
+import csv
+import json
+import codecs
+from collections import Counter
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.http import StreamingHttpResponse
+from .models import Product
+from .serializers import ProductImportSerializer
+from .images import queue_photo_variants
+from .storage import photo_storage
+from . import facets, productcache, search, searchindex
+
+CHUNK_SIZE = getattr(settings, 'PRODUCT_IMPORT_CHUNK_SIZE', 1000)
+# row errors reported back, the rest are only counted
+MAX_ERRORS = getattr(settings, 'PRODUCT_IMPORT_MAX_ERRORS', 500)
+EXPORT_CHUNK_SIZE = getattr(settings, 'API_STREAM_CHUNK_SIZE', 2000)
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('id','name','description','cost','stock','photo','category')
+
+class InvalidImport(ValueError):
+	pass
+
+def detect_format(name, requested=None):
+	fmt = (requested or name.rsplit('.', 1)[-1]).lower()
+	if fmt in ('json', 'ndjson'):
+		fmt = 'jsonl'
+	if fmt not in FORMATS:
+		raise InvalidImport('filetype must be one of %s' % ', '.join(FORMATS))
+	return fmt
+
+def read_rows(upload, fmt):
+	"""
+	Yields (line, row) from an uploaded file one line at a time, row is a
+	dict or None when the line could not be parsed.
+	"""
+	lines = codecs.iterdecode(upload, 'utf-8-sig')
+	if fmt == 'csv':
+		reader = csv.DictReader(lines)
+		for row in reader:
+			yield reader.line_num, row
+		return
+	for number, line in enumerate(lines, 1):
+		if not line.strip():
+			continue
+		try:
+			row = json.loads(line)
+		except ValueError:
+			row = None
+		yield number, row if isinstance(row, dict) else None
+
+class ImportReport(object):
+
+	def __init__(self):
+		self.created = 0
+		self.failed = 0
+		self.errors = []
+
+	def error(self, line, errors):
+		self.failed += 1
+		if len(self.errors) < MAX_ERRORS:
+			self.errors.append({'line':line, 'errors':errors})
+
+	def as_dict(self):
+		return {'created':self.created, 'failed':self.failed, 'errors':self.errors}
+
+def save_chunk(products):
+	"""
+	Inserts one chunk and does what the post_save receivers would have done
+	for each product, with one statement per kind of work. Products whose
+	photo is no longer stored are left out, their photo names are returned.
+	"""
+	with transaction.atomic():
+		photos = Counter(product.photo.name for product in products)
+		stored = photo_storage.retain_all(photos)
+		products = [product for product in products if product.photo.name in stored]
+		if not products:
+			return set(photos)-stored
+		seller = products[0].created_by_id
+		last = None
+		if not connection.features.can_return_ids_from_bulk_insert:
+			last = Product.objects.filter(created_by_id=seller).aggregate(last=Max('id'))['last'] or 0
+		Product.objects.bulk_create(products)
+		if last is None:
+			ids = [product.pk for product in products]
+		else:
+			# only PostgreSQL hands the new ids back, elsewhere they are read
+			# again as the seller's products added after the last known id
+			ids = list(Product.objects.filter(created_by_id=seller, id__gt=last).values_list('id', flat=True))
+		if ids:
+			search.update_search_vector(Product.objects.filter(id__in=ids))
+			transaction.on_commit(lambda: queue_photo_variants(ids))
+		counts = Counter(key for product in products for key in facets.facet_keys(product.category, product.cost))
+		for (kind, value), count in sorted(counts.items()):
+			facets.bump(kind, value, count)
+	return set(photos)-stored
+
+def import_chunk(report, chunk, lines):
+	gone = save_chunk(chunk)
+	for line, product in zip(lines, chunk):
+		if product.photo.name in gone:
+			report.error(line, {'photo':[ProductImportSerializer.photo_error]})
+		else:
+			report.created += 1
+
+def import_products(user, upload, fmt):
+	"""
+	Validates the rows of a CSV or JSON lines file with ProductImportSerializer
+	and inserts the valid ones for user, CHUNK_SIZE rows per transaction.
+	Memory use depends on the chunk size, not on the size of the file.
+	"""
+	report = ImportReport()
+	chunk = []
+	lines = []
+	try:
+		for line, row in read_rows(upload, fmt):
+			if row is None:
+				report.error(line, {'row':['not a valid %s row' % fmt]})
+				continue
+			serializer = ProductImportSerializer(data=row)
+			if not serializer.is_valid():
+				report.error(line, serializer.errors)
+				continue
+			chunk.append(Product(created_by=user, **serializer.validated_data))
+			lines.append(line)
+			if len(chunk) >= CHUNK_SIZE:
+				import_chunk(report, chunk, lines)
+				chunk = []
+				lines = []
+		if chunk:
+			import_chunk(report, chunk, lines)
+	except (UnicodeDecodeError, csv.Error) as e:
+		report.error(None, {'file':[str(e)]})
+	finally:
+		if report.created:
+			searchindex.reset()
+			productcache.invalidate('catalog')
+			productcache.invalidate('facets')
+	return report
+
+class Echo(object):
+	# csv.writer target that hands the formatted line back instead of storing it
+	def write(self, value):
+		return value
+
+def export_rows(queryset, fmt):
+	rows = queryset.order_by('id').values_list(*FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+	if fmt == 'csv':
+		writer = csv.writer(Echo())
+		yield writer.writerow(FIELDS)
+		for row in rows:
+			yield writer.writerow(row)
+		return
+	for row in rows:
+		yield json.dumps(dict(zip(FIELDS, row)))+'\n'
+
+def export_response(queryset, fmt):
+	"""
+	Streams the products in queryset as CSV or JSON lines, in the columns
+	import_products reads back.
+	"""
+	content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+	response = StreamingHttpResponse(export_rows(queryset, fmt), content_type=content_type)
+	response['Content-Disposition'] = 'attachment; filename="products.%s"' % fmt
+	return response
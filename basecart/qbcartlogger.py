@@ -1,14 +1,182 @@
 import pika
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import deque
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+ENABLED = getattr(settings, 'QBCARTLOG_ENABLED', True)
+QUEUE_NAME = getattr(settings, 'QBCARTLOG_QUEUE', 'qbcartlog')
+BROKER_HOST = getattr(settings, 'QBCARTLOG_BROKER_HOST', 'localhost')
+# number of publisher threads, each one owns its own connection/channel
+POOL_SIZE = getattr(settings, 'QBCARTLOG_POOL_SIZE', 1)
+# messages held in memory while the broker is slow or unreachable
+BUFFER_SIZE = getattr(settings, 'QBCARTLOG_BUFFER_SIZE', 10000)
+BACKOFF_MIN = getattr(settings, 'QBCARTLOG_BACKOFF_MIN', 0.5)
+BACKOFF_MAX = getattr(settings, 'QBCARTLOG_BACKOFF_MAX', 30)
+
+class LogPublisher(object):
+	"""
+	Long lived activity log publisher.
+
+	Messages are put on a bounded in-memory buffer and published by
+	background threads over persistent connections with publisher
+	confirms enabled. When the buffer is full new messages are dropped
+	instead of blocking the request.
+	"""
+
+	def __init__(self, host=BROKER_HOST, queue_name=QUEUE_NAME, pool_size=POOL_SIZE, buffer_size=BUFFER_SIZE):
+		self.host = host
+		self.queue_name = queue_name
+		self.pool_size = pool_size
+		self.buffer = queue.Queue(maxsize=buffer_size)
+		self.lock = threading.Lock()
+		self.counters = {'buffered':0, 'dropped':0, 'confirmed':0, 'nacked':0, 'reconnects':0}
+		self.stopping = threading.Event()
+		self.workers = []
+		for i in range(pool_size):
+			worker = threading.Thread(target=self._run, name='qbcartlog-publisher-%d' % i)
+			worker.daemon = True
+			worker.start()
+			self.workers.append(worker)
+
+	def _count(self, name, value=1):
+		with self.lock:
+			self.counters[name] += value
+
+	def publish(self, message):
+		try:
+			self.buffer.put_nowait(message)
+		except queue.Full:
+			self._count('dropped')
+			return False
+		self._count('buffered')
+		return True
+
+	def stats(self):
+		with self.lock:
+			counters = dict(self.counters)
+		counters['pending'] = self.buffer.qsize()
+		return counters
+
+	def _connect(self):
+		connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+		channel = connection.channel()
+		channel.queue_declare(queue=self.queue_name)
+		channel.confirm_delivery()
+		return connection, channel
+
+	def _close(self, connection):
+		try:
+			if connection is not None and connection.is_open:
+				connection.close()
+		except Exception:
+			pass
+
+	def _run(self):
+		connection = channel = None
+		message = None
+		backoff = BACKOFF_MIN
+		while True:
+			if message is None:
+				try:
+					message = self.buffer.get(timeout=1)
+				except queue.Empty:
+					if self.stopping.is_set():
+						break
+					continue
+			try:
+				if channel is None or not channel.is_open:
+					self._close(connection)
+					connection, channel = self._connect()
+					backoff = BACKOFF_MIN
+				delivered = channel.basic_publish(exchange='',
+					routing_key=self.queue_name,
+					body=message)
+			except pika.exceptions.AMQPError as e:
+				# keep the message and retry it once the broker is back
+				logger.warning('qbcartlog publish failed (%s), retrying in %ss', e, backoff)
+				self._close(connection)
+				connection = channel = None
+				self._count('reconnects')
+				if self.stopping.wait(backoff):
+					self._count('dropped', 1+self._discard())
+					break
+				backoff = min(backoff*2, BACKOFF_MAX)
+				continue
+			# pika 0.x returns False on nack, later versions raise instead
+			if delivered is False:
+				self._count('nacked')
+			else:
+				self._count('confirmed')
+			self.buffer.task_done()
+			message = None
+		self._close(connection)
+
+	def _discard(self):
+		# closing while the broker is away, nothing left in the buffer gets sent
+		discarded = 0
+		while True:
+			try:
+				self.buffer.get_nowait()
+			except queue.Empty:
+				return discarded
+			self.buffer.task_done()
+			discarded += 1
+
+	def close(self, timeout=5):
+		self.stopping.set()
+		deadline = time.time()+timeout
+		for worker in self.workers:
+			worker.join(max(0, deadline-time.time()))
+
+class MemoryPublisher(object):
+	"""
+	Keeps the latest messages in memory, used when QBCARTLOG_ENABLED is off.
+	"""
+
+	def __init__(self, buffer_size=BUFFER_SIZE):
+		self.messages = deque(maxlen=buffer_size)
+
+	def publish(self, message):
+		self.messages.append(message)
+		return True
+
+	def stats(self):
+		return {'buffered':len(self.messages), 'dropped':0, 'confirmed':0, 'nacked':0, 'reconnects':0, 'pending':0}
+
+	def close(self, timeout=5):
+		pass
+
+_publisher = None
+_publisher_pid = None
+_publisher_lock = threading.Lock()
+
+def get_publisher():
+	# connections can not be shared across fork, so each process gets its own pool
+	global _publisher, _publisher_pid
+	if _publisher is None or _publisher_pid != os.getpid():
+		with _publisher_lock:
+			if _publisher is None or _publisher_pid != os.getpid():
+				_publisher = LogPublisher() if ENABLED else MemoryPublisher()
+				_publisher_pid = os.getpid()
+				atexit.register(_publisher.close)
+	return _publisher
 
 def logdata(message):
-	print('hello')
-	connection=pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-	channel= connection.channel()
+	return get_publisher().publish(message)
 
-	channel.queue_declare(queue='qbcartlog')
-	channel.basic_publish(exchange='',
-		routing_key='qbcartlog',
-		body=message)
+def logbatch(events):
+	# many events in one message, the consumer writes them together
+	if not events:
+		return True
+	return get_publisher().publish(json.dumps(events))
 
-	print('[x] Sent'+ message)
-	connection.close()
+def logstats():
+	return get_publisher().stats()
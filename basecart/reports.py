@@ -0,0 +1,54 @@
+import io
+import csv
+import gzip
+import tempfile
+from django.db.models import Count, F, Sum
+from .models import Order
+
+TOP_N = 10
+
+def revenue():
+	return Sum(F('quantity')*F('product__cost'))
+
+def with_totals(rows):
+	# revenue is annotated first, once quantity is F('quantity') means the sum
+	return rows.annotate(revenue=revenue()).annotate(orders=Count('id'), quantity=Sum('quantity'))
+
+def order_report(orders, top=TOP_N):
+	"""
+	Totals for an Order queryset, computed in the database so the cost
+	does not depend on how many orders there are: overall totals, totals
+	per status, and the top sellers and products by revenue.
+	"""
+	orders = orders.order_by()
+	statuses = dict(Order.STATUSES)
+	report = orders.aggregate(revenue=revenue(), orders=Count('id'), quantity=Sum('quantity'))
+	report['by_status'] = [
+		dict(row, name=statuses.get(row['status'], row['status']))
+		for row in with_totals(orders.values('status')).order_by('status')]
+	report['top_sellers'] = list(with_totals(orders.values('product__created_by__username')).order_by('-revenue')[:top])
+	report['top_products'] = list(with_totals(orders.values('product__id','product__name')).order_by('-revenue')[:top])
+	return report
+
+CSV_COLUMNS = ('id','order_date','status','user__username','product__name','product__created_by__username','quantity','product__cost','price')
+
+def write_orders_csv(orders, fileobj):
+	# values_list() and iterator() keep one chunk of rows in memory at a time
+	writer = csv.writer(fileobj)
+	writer.writerow(CSV_COLUMNS)
+	for row in orders.order_by('id').values_list(*CSV_COLUMNS).iterator():
+		writer.writerow(row)
+
+def orders_csv_gz(orders):
+	"""
+	Gzipped CSV of every order in the queryset. Rows are streamed to a
+	temporary file that only moves to disk once it gets large.
+	"""
+	with tempfile.SpooledTemporaryFile(max_size=1024*1024) as spool:
+		with gzip.GzipFile(fileobj=spool, mode='wb') as compressed:
+			text = io.TextIOWrapper(compressed, encoding='utf8', newline='')
+			write_orders_csv(orders, text)
+			text.flush()
+			text.detach()
+		spool.seek(0)
+		return spool.read()
@@ -0,0 +1,135 @@
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Order, SalesRollup, RollupMark
+
+# every run recomputes at least this many trailing hours, which picks up
+# status changes and orders whose transaction committed after a later id
+REFRESH_HOURS = getattr(settings, 'SALES_ROLLUP_REFRESH_HOURS', 24)
+# orders changed this many minutes before the last run are looked at again,
+# for transactions that were still open while it ran
+TOUCH_MARGIN = getattr(settings, 'SALES_ROLLUP_TOUCH_MARGIN', 10)
+MARK = 'sales'
+
+DIMENSION_FIELDS = (
+	(SalesRollup.Product, 'product'),
+	(SalesRollup.Seller, 'product__created_by'),
+	(SalesRollup.Category, 'product__category'),
+)
+
+def floor_day(moment):
+	# buckets follow the local day, the same as TruncDay
+	return timezone.make_aware(datetime.combine(timezone.localtime(moment).date(), time()))
+
+def parse_moment(value):
+	"""
+	Aware datetime from an ISO datetime or date, ValueError if it is neither.
+	"""
+	moment = parse_datetime(value)
+	if moment is None:
+		day = parse_date(value)
+		if day is None:
+			raise ValueError('invalid date %r' % value)
+		moment = datetime.combine(day, time())
+	if timezone.is_naive(moment):
+		moment = timezone.make_aware(moment)
+	return moment
+
+def hourly_rows(start, end):
+	orders = Order.objects.filter(order_date__gte=start, order_date__lt=end).order_by().annotate(bucket=TruncHour('order_date'))
+	rows = []
+	for dimension, field in DIMENSION_FIELDS:
+		# revenue first, the quantity annotation would shadow the field in F('quantity')
+		for row in orders.values('bucket','status',field).annotate(revenue=Sum(F('quantity')*F('product__cost'))).annotate(
+				orders=Count('id'), quantity=Sum('quantity')):
+			rows.append(SalesRollup(period=SalesRollup.Hourly, bucket=row['bucket'], dimension=dimension, key=row[field],
+				status=row['status'], orders=row['orders'], quantity=row['quantity'], revenue=row['revenue']))
+	return rows
+
+def daily_rows(start, end):
+	# days are summed from the hourly rows, not from the orders again
+	hours = SalesRollup.objects.filter(period=SalesRollup.Hourly, bucket__gte=start, bucket__lt=end).order_by()
+	return [
+		SalesRollup(period=SalesRollup.Daily, bucket=row['day'], dimension=row['dimension'], key=row['key'],
+			status=row['status'], orders=row['orders'], quantity=row['quantity'], revenue=row['revenue'])
+		for row in hours.annotate(day=TruncDay('bucket')).values('day','dimension','key','status').annotate(
+			orders=Sum('orders'), quantity=Sum('quantity'), revenue=Sum('revenue'))]
+
+def rebuild(start, end):
+	"""
+	Recomputes every rollup row of the days between start and end, both
+	rounded out to whole days.
+	"""
+	start = floor_day(start)
+	end = floor_day(end)+timedelta(days=1)
+	with transaction.atomic():
+		SalesRollup.objects.filter(bucket__gte=start, bucket__lt=end).delete()
+		SalesRollup.objects.bulk_create(hourly_rows(start, end), batch_size=1000)
+		SalesRollup.objects.bulk_create(daily_rows(start, end), batch_size=1000)
+	return start, end
+
+def touched_days(since, before):
+	# days before the refreshed range holding orders changed since the last run
+	return list(Order.objects.filter(updated__gte=since, order_date__lt=before).annotate(
+		day=TruncDay('order_date')).order_by('day').values_list('day', flat=True).distinct())
+
+def update_rollups(now=None):
+	"""
+	Brings the rollups up to date and returns where the recomputation
+	started: the oldest order added since the last run, or REFRESH_HOURS
+	ago, whichever is earlier. Only those days are read from Order, plus
+	the days of older orders changed since the last run, such as late
+	cancellations.
+
+	Deleting orders is not tracked, rows of deleted orders stay until
+	their day is rebuilt with the backfillrollups command.
+	"""
+	now = now or timezone.now()
+	with transaction.atomic():
+		# the row lock keeps two runs from rebuilding the same days at once
+		mark = RollupMark.objects.select_for_update().get_or_create(name=MARK)[0]
+		new = Order.objects.filter(id__gt=mark.order_id).aggregate(last=Max('id'), first=Min('order_date'))
+		start = now-timedelta(hours=REFRESH_HOURS)
+		if new['first'] is not None and new['first'] < start:
+			start = new['first']
+		start = rebuild(start, now)[0]
+		if mark.updated is not None:
+			for day in touched_days(mark.updated-timedelta(minutes=TOUCH_MARGIN), start):
+				rebuild(day, day)
+		if new['last'] is not None:
+			mark.order_id = new['last']
+		mark.updated = now
+		mark.save()
+	return start
+
+def filter_rollups(period, dimension, start=None, end=None, status=Order.Placed, keys=None):
+	rows = SalesRollup.objects.filter(period=period, dimension=dimension)
+	if status is not None:
+		rows = rows.filter(status=status)
+	if start is not None:
+		rows = rows.filter(bucket__gte=start)
+	if end is not None:
+		rows = rows.filter(bucket__lt=end)
+	if keys is not None:
+		rows = rows.filter(key__in=keys)
+	return rows.order_by()
+
+def sales_totals(period, dimension, start=None, end=None, status=Order.Placed, keys=None, limit=None):
+	"""
+	Orders, quantity and revenue per key over the buckets in [start, end),
+	biggest revenue first.
+	"""
+	rows = filter_rollups(period, dimension, start, end, status, keys).values('key').annotate(
+		orders=Sum('orders'), quantity=Sum('quantity'), revenue=Sum('revenue')).order_by('-revenue','key')
+	return list(rows[:limit] if limit else rows)
+
+def sales_series(period, dimension, start=None, end=None, status=Order.Placed, keys=None):
+	"""
+	Orders, quantity and revenue per bucket in [start, end), oldest first.
+	"""
+	return list(filter_rollups(period, dimension, start, end, status, keys).values('bucket').annotate(
+		orders=Sum('orders'), quantity=Sum('quantity'), revenue=Sum('revenue')).order_by('bucket'))
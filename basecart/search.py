@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import Product
+
+MAX_RESULTS = 200
+
+def search_vector():
+	from django.contrib.postgres.search import SearchVector
+	return SearchVector('name', weight='A', config='english')+SearchVector('description', weight='B', config='english')
+
+def search_backend():
+	# 'postgres' ranks with full text search, 'memory' uses basecart.searchindex
+	backend = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+	if backend:
+		return backend
+	return 'postgres' if connection.vendor == 'postgresql' else 'memory'
+
+def uses_postgres():
+	return connection.vendor == 'postgresql'
+
+def update_search_vector(queryset):
+	if uses_postgres():
+		queryset.update(search_vector=search_vector())
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+	update_search_vector(Product.objects.filter(pk=instance.pk))
+
+def parse_filters(params):
+	"""
+	Reads q, category, min_cost and max_cost from a QueryDict, ignoring
+	values that are not valid.
+	"""
+	filters = {'query':params.get('q', '').strip()}
+	categories = dict(Product.CATEGORIES)
+	try:
+		category = int(params.get('category', ''))
+		if category in categories:
+			filters['category'] = category
+	except ValueError:
+		pass
+	for name in ('min_cost','max_cost'):
+		try:
+			filters[name] = max(0, int(params.get(name, '')))
+		except ValueError:
+			pass
+	return filters
+
+def has_filters(filters):
+	return bool(filters.get('query')) or len(filters) > 1
+
+def filter_products(queryset, category=None, min_cost=None, max_cost=None):
+	if category is not None:
+		queryset = queryset.filter(category=category)
+	if min_cost is not None:
+		queryset = queryset.filter(cost__gte=min_cost)
+	if max_cost is not None:
+		queryset = queryset.filter(cost__lte=max_cost)
+	return queryset
+
+def search_products(query='', category=None, min_cost=None, max_cost=None, limit=MAX_RESULTS):
+	"""
+	Products matching the words in query, best match first, narrowed by
+	category and cost range.
+
+	On PostgreSQL this ranks against the precomputed search_vector column
+	through its GIN index; other databases use the in-process inverted
+	index, which also matches the last word as a prefix.
+	"""
+	queryset = filter_products(Product.objects.for_listing(), category, min_cost, max_cost)
+	if not query:
+		return list(queryset.order_by('id')[:limit])
+	if search_backend() == 'memory':
+		from .searchindex import get_index
+		ids = get_index().search(query, category, min_cost, max_cost, limit)
+		products = Product.objects.for_listing().in_bulk(ids)
+		return [products[pk] for pk in ids if pk in products]
+	from django.contrib.postgres.search import SearchQuery, SearchRank
+	search_query = SearchQuery(query, config='english')
+	queryset = queryset.filter(search_vector=search_query).annotate(
+		rank=SearchRank(F('search_vector'), search_query)).order_by('-rank','id')
+	return list(queryset[:limit])
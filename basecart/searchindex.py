@@ -0,0 +1,184 @@
+import re
+import sys
+import bisect
+import threading
+from array import array
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Product
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+NAME_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+def tokenize(text):
+	# interned so every product shares one copy of each term string
+	return tuple(sys.intern(term) for term in set(TOKEN.findall((text or '').lower())))
+
+class InvertedIndex(object):
+	"""
+	Pure python product search for deployments without PostgreSQL.
+
+	Every term maps to a sorted array('I') of product ids, one posting list
+	for names and one for descriptions, and the terms themselves are kept
+	in a sorted list so a prefix is a bisect range. The last word of a
+	query is matched as a prefix, which is what autocomplete needs.
+	"""
+
+	def __init__(self):
+		self.lock = threading.RLock()
+		self.clear()
+
+	def clear(self):
+		with self.lock:
+			self.fields = {'name':{}, 'description':{}}
+			self.terms = []
+			# id -> (category, cost, name terms, description terms)
+			self.docs = {}
+
+	def build(self, products):
+		fields = {'name':{}, 'description':{}}
+		docs = {}
+		for pk, name, description, category, cost in products:
+			name_terms = tokenize(name)
+			description_terms = tokenize(description)
+			docs[pk] = (category, cost, name_terms, description_terms)
+			for field, terms in (('name', name_terms), ('description', description_terms)):
+				postings = fields[field]
+				for term in terms:
+					postings.setdefault(term, []).append(pk)
+		for postings in fields.values():
+			for term in postings:
+				postings[term] = array('I', sorted(postings[term]))
+		terms = sorted(set(fields['name']) | set(fields['description']))
+		with self.lock:
+			self.fields = fields
+			self.docs = docs
+			self.terms = terms
+
+	def _add_posting(self, field, term, pk):
+		postings = self.fields[field]
+		ids = postings.get(term)
+		if ids is None:
+			postings[term] = array('I', [pk])
+			position = bisect.bisect_left(self.terms, term)
+			if position == len(self.terms) or self.terms[position] != term:
+				self.terms.insert(position, term)
+			return
+		position = bisect.bisect_left(ids, pk)
+		if position == len(ids) or ids[position] != pk:
+			ids.insert(position, pk)
+
+	def _remove_posting(self, field, term, pk):
+		postings = self.fields[field]
+		ids = postings.get(term)
+		if ids is None:
+			return
+		position = bisect.bisect_left(ids, pk)
+		if position < len(ids) and ids[position] == pk:
+			del ids[position]
+		if not ids:
+			del postings[term]
+			if term not in self.fields['name'] and term not in self.fields['description']:
+				position = bisect.bisect_left(self.terms, term)
+				if position < len(self.terms) and self.terms[position] == term:
+					del self.terms[position]
+
+	def remove(self, pk):
+		with self.lock:
+			doc = self.docs.pop(pk, None)
+			if doc is None:
+				return
+			for term in doc[2]:
+				self._remove_posting('name', term, pk)
+			for term in doc[3]:
+				self._remove_posting('description', term, pk)
+
+	def add(self, pk, name, description, category, cost):
+		with self.lock:
+			self.remove(pk)
+			name_terms = tokenize(name)
+			description_terms = tokenize(description)
+			self.docs[pk] = (category, cost, name_terms, description_terms)
+			for term in name_terms:
+				self._add_posting('name', term, pk)
+			for term in description_terms:
+				self._add_posting('description', term, pk)
+
+	def expand(self, word, prefix):
+		if not prefix:
+			return [word]
+		start = bisect.bisect_left(self.terms, word)
+		end = bisect.bisect_left(self.terms, word+'\uffff')
+		return self.terms[start:end]
+
+	def scores(self, word, prefix):
+		scores = {}
+		for term in self.expand(word, prefix):
+			for field, weight in (('name', NAME_WEIGHT), ('description', DESCRIPTION_WEIGHT)):
+				for pk in self.fields[field].get(term, ()):
+					if scores.get(pk, 0) < weight:
+						scores[pk] = weight
+		return scores
+
+	def search(self, query, category=None, min_cost=None, max_cost=None, limit=50):
+		"""
+		Ids of products containing every word of query, best first.
+		"""
+		words = TOKEN.findall(query.lower())
+		if not words:
+			return []
+		with self.lock:
+			total = None
+			for position, word in enumerate(words):
+				scores = self.scores(word, prefix=position == len(words)-1)
+				if total is None:
+					total = scores
+				else:
+					total = dict((pk, total[pk]+score) for pk, score in scores.items() if pk in total)
+				if not total:
+					return []
+			matches = []
+			for pk, score in total.items():
+				doc_category, cost = self.docs[pk][:2]
+				if category is not None and doc_category != category:
+					continue
+				if min_cost is not None and cost < min_cost:
+					continue
+				if max_cost is not None and cost > max_cost:
+					continue
+				matches.append((-score, pk))
+		matches.sort()
+		return [pk for score, pk in matches[:limit]]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+	# built on first use so starting a process never touches the database.
+	# Each process keeps its own copy and only sees its own saves, which is
+	# fine for the single process SQLite deployments this is meant for.
+	global _index
+	if _index is None:
+		with _index_lock:
+			if _index is None:
+				index = InvertedIndex()
+				index.build(Product.objects.values_list('id','name','description','category','cost').iterator())
+				_index = index
+	return _index
+
+def reset():
+	# for bulk changes that skip the signals, the next search rebuilds the index
+	global _index
+	with _index_lock:
+		_index = None
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+	if _index is not None:
+		_index.add(instance.pk, instance.name, instance.description, instance.category, instance.cost)
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+	if _index is not None:
+		_index.remove(instance.pk)
@@ -1,21 +1,56 @@
 from .models import CartUser,Product,Cart,Order
 from rest_framework import serializers
+from .images import photo_url
+from .storage import is_blob_name
+
+class PhotoVariantField(serializers.ReadOnlyField):
+	"""
+	URL of one resized copy of Product.photo, see basecart.images.
+	"""
+
+	def __init__(self, variant, **kwargs):
+		self.variant = variant
+		kwargs['source'] = '*'
+		super(PhotoVariantField, self).__init__(**kwargs)
+
+	def to_representation(self, product):
+		return photo_url(product, self.variant)
 
 class ProductSerializer(serializers.ModelSerializer):
+	thumbnail = PhotoVariantField('card')
+
 	class Meta:
 		model = Product
-		fields = ('id','name', 'cost','photo', 'category')
+		fields = ('id','name', 'cost','photo','thumbnail', 'category')
 
 class ProductDetailSerializer(serializers.ModelSerializer):
+	thumbnail = PhotoVariantField('card')
+	web_photo = PhotoVariantField('web')
+
 	class Meta:
 		model = Product
-		fields = ('id','name','description', 'cost','stock','photo','category','created_by')
+		fields = ('id','name','description', 'cost','stock','photo','thumbnail','web_photo','category','created_by')
 
 class ProductCreateSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = Product
 		fields = ('name','description', 'cost','stock','photo','category','created_by')
 
+class ProductImportSerializer(ProductCreateSerializer):
+	# imported rows name a photo the site already stores, as sent in the photo field of a product
+	photo = serializers.CharField(max_length=100)
+	photo_error = 'photo must name a stored product photo'
+
+	class Meta(ProductCreateSerializer.Meta):
+		fields = ('name','description', 'cost','stock','photo','category')
+
+	def validate_photo(self, value):
+		# only reference counted blobs, so deleting the product can never remove a file somebody else uses,
+		# productio.save_chunk checks they are still stored for the whole chunk at once
+		if not is_blob_name(value):
+			raise serializers.ValidationError(self.photo_error)
+		return value
+
 class CartCreateSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = Cart
@@ -26,6 +61,12 @@ class CartSerializer(serializers.ModelSerializer):
 		model = Cart
 		fields = ('id','product', 'quantity','status')
 
+class CartOperationSerializer(serializers.Serializer):
+	op = serializers.ChoiceField(choices=('add','update','remove'))
+	product = serializers.IntegerField()
+	quantity = serializers.IntegerField(min_value=1, required=False)
+	status = serializers.ChoiceField(choices=Cart.STATUSES, required=False)
+
 class OrderCreateSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = Order
@@ -34,4 +75,11 @@ class OrderCreateSerializer(serializers.ModelSerializer):
 class OrderSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = Order
-		fields = ('id','product', 'quantity','status','price','order_date')
\ No newline at end of file
+		fields = ('id','product', 'quantity','status','price','order_date')
+
+class OrderLineSerializer(serializers.ModelSerializer):
+	line_total = serializers.IntegerField(read_only=True)
+
+	class Meta:
+		model = Order
+		fields = ('id','product', 'quantity','status','price','order_date','line_total')
\ No newline at end of file
@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models import F
+from .models import Product
+from .productcache import invalidate_product
+
+class StockReport(object):
+	"""
+	Result of a stock reservation.
+
+	reserved maps product id to the quantity taken from stock, failed maps
+	product id to {'name','requested','available'} for every product that
+	did not have enough stock.
+	"""
+
+	def __init__(self):
+		self.reserved = {}
+		self.failed = {}
+
+	@property
+	def ok(self):
+		return not self.failed
+
+def reserve_stock(lines, partial=False):
+	"""
+	Takes quantities out of Product.stock for {product_id: quantity}.
+
+	Every product is decremented with a conditional UPDATE, so stock can
+	never go below zero, and rows are touched in product id order so
+	concurrent checkouts lock them in the same order and can not deadlock.
+	Unless partial is set, a single failure rolls back the whole order.
+	"""
+	report = StockReport()
+	with transaction.atomic():
+		for product_id in sorted(lines):
+			quantity = int(lines[product_id])
+			updated = Product.objects.filter(id=product_id, stock__gte=quantity).update(stock=F('stock')-quantity)
+			if updated:
+				report.reserved[product_id] = quantity
+				transaction.on_commit(lambda product_id=product_id: invalidate_product(product_id, catalog=False))
+			else:
+				report.failed[product_id] = {'name':'','requested':quantity,'available':0}
+		if report.failed:
+			for product in Product.objects.filter(id__in=list(report.failed)).only('id','name','stock'):
+				report.failed[product.id].update(name=product.name, available=product.stock)
+			if not partial:
+				transaction.set_rollback(True)
+				report.reserved = {}
+	return report
+
+def release_stock(lines):
+	with transaction.atomic():
+		for product_id in sorted(lines):
+			Product.objects.filter(id=product_id).update(stock=F('stock')+int(lines[product_id]))
+			transaction.on_commit(lambda product_id=product_id: invalidate_product(product_id, catalog=False))
@@ -0,0 +1,172 @@
+import os
+import re
+import hashlib
+import tempfile
+import posixpath
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils.deconstruct import deconstructible
+
+# names that never change content: blobs named by their sha256, and the
+# resized copies basecart.images names after the hash of their original
+IMMUTABLE_NAME = re.compile(r'(/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?|\.[0-9a-f]{16}\.jpg)$')
+BLOB_NAME = re.compile(r'/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+EXTENSION = re.compile(r'^\.\w{1,10}$')
+
+def is_immutable(name):
+	return bool(IMMUTABLE_NAME.search(name))
+
+def is_blob_name(name):
+	return bool(BLOB_NAME.search(name))
+
+def blobs():
+	return apps.get_model('basecart', 'StoredBlob').objects
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+	"""
+	File system storage that names every file after the sha256 of its
+	content and keeps one copy of each, however often it is uploaded.
+
+	Uploads are hashed chunk by chunk while they are copied to a temporary
+	file, so they are never held in memory. StoredBlob counts the users of
+	every file and delete() only removes it from disk once the last one is
+	gone. A blob row is locked while its file is added or removed, which
+	keeps a save and a delete of the same content from racing.
+	"""
+
+	def get_available_name(self, name, max_length=None):
+		# the final name comes from the content, see _save
+		return name
+
+	def blob_name(self, name, digest):
+		extension = os.path.splitext(name)[1].lower()
+		if not EXTENSION.match(extension):
+			extension = ''
+		return posixpath.join(posixpath.dirname(name), digest[:2], digest[2:4], digest+extension)
+
+	def _save(self, name, content):
+		incoming = os.path.join(self.location, '.incoming')
+		os.makedirs(incoming, exist_ok=True)
+		digest = hashlib.sha256()
+		size = 0
+		with tempfile.NamedTemporaryFile(dir=incoming, delete=False) as temporary:
+			for chunk in content.chunks():
+				digest.update(chunk)
+				size += len(chunk)
+				temporary.write(chunk)
+		try:
+			name = self.blob_name(name, digest.hexdigest())
+			path = self.path(name)
+			with transaction.atomic():
+				blob = self.lock(name, size)
+				if blob.refs <= 0 or not os.path.exists(path):
+					os.makedirs(os.path.dirname(path), exist_ok=True)
+					os.replace(temporary.name, path)
+					if self.file_permissions_mode is not None:
+						os.chmod(path, self.file_permissions_mode)
+				blob.refs = max(blob.refs, 0)+1
+				blob.save(update_fields=['refs'])
+		finally:
+			if os.path.exists(temporary.name):
+				os.remove(temporary.name)
+		return name
+
+	def lock(self, name, size=0):
+		try:
+			with transaction.atomic():
+				blobs().create(name=name, size=size)
+		except IntegrityError:
+			pass
+		return blobs().select_for_update().get(name=name)
+
+	def retain(self, name, count=1):
+		"""
+		Adds count users to a stored file, for names assigned without an upload.
+		Returns False when the file is not stored, see retain_all.
+		"""
+		return name in self.retain_all({name:count})
+
+	def retain_all(self, counts):
+		"""
+		Adds counts[name] users to each stored file in counts and returns the
+		names that were added to. Files whose last user is gone may already be
+		removed and are left out, like names that are not blobs. The rows stay
+		locked until the calling transaction ends, so a delete() can not
+		remove a file the caller goes on to use.
+		"""
+		names = sorted(name for name in counts if is_blob_name(name))
+		with transaction.atomic():
+			# locked in name order, two callers never wait on each other's rows
+			kept = list(blobs().select_for_update().filter(name__in=names, refs__gt=0).order_by('name').values_list('name', flat=True))
+			by_count = {}
+			for name in kept:
+				by_count.setdefault(counts[name], []).append(name)
+			for count, group in by_count.items():
+				blobs().filter(name__in=group).update(refs=F('refs')+count)
+		return set(kept)
+
+	def delete(self, name):
+		"""
+		Drops one user of the file, the file goes when nobody uses it.
+		Files saved before this storage was used have no blob row and
+		nothing tells who else uses them, so they are left alone, see
+		delete_legacy.
+		"""
+		with transaction.atomic():
+			blob = blobs().select_for_update().filter(name=name).first()
+			if blob is None:
+				return
+			blob.refs = max(blob.refs-1, 0)
+			blob.save(update_fields=['refs'])
+			if not blob.refs:
+				super(ContentAddressedStorage, self).delete(name)
+
+	def delete_legacy(self, name):
+		# for the dedupephotos command, which checks no product uses the file
+		if blobs().filter(name=name).exists():
+			raise ValueError('%s is a stored blob, use delete()' % name)
+		super(ContentAddressedStorage, self).delete(name)
+
+photo_storage = ContentAddressedStorage()
+
+def counted(storage):
+	return isinstance(storage, ContentAddressedStorage)
+
+def uploaded(product):
+	# a deferred photo was not touched, reading it would cost a query
+	return 'photo' in product.__dict__ and bool(product.photo) and not product.photo._committed
+
+# Product is referred to by name, models imports this module for photo_storage
+@receiver(pre_save, sender='basecart.Product')
+def remember_photo(sender, instance, **kwargs):
+	# pre_save runs before FileField commits the upload
+	instance._photo_uploaded = uploaded(instance)
+
+@receiver(post_save, sender='basecart.Product')
+def photo_saved(sender, instance, created, **kwargs):
+	if 'photo' not in instance.__dict__ or (not created and not hasattr(instance, '_loaded_photo')):
+		return
+	name = instance.photo.name or ''
+	old = getattr(instance, '_loaded_photo', None) or ''
+	if name == old:
+		return
+	storage = instance.photo.storage
+	if not counted(storage):
+		return
+	if name and not getattr(instance, '_photo_uploaded', False):
+		storage.retain(name)
+	if old:
+		transaction.on_commit(lambda: storage.delete(old))
+	instance._loaded_photo = name
+
+@receiver(post_delete, sender='basecart.Product')
+def photo_deleted(sender, instance, **kwargs):
+	storage = instance.photo.storage
+	if instance.photo.name and counted(storage):
+		name = instance.photo.name
+		transaction.on_commit(lambda: storage.delete(name))
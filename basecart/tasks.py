@@ -0,0 +1,113 @@
+from celery import shared_task
+from collections import OrderedDict
+import logging, smtplib, socket, time
+
+from django.core.mail import EmailMessage, get_connection
+from django.template import loader, Context
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+from .models import Order,CartUser
+from .reports import order_report,orders_csv_gz
+from .rollups import update_rollups
+from .images import process_product_image
+from .cartbatch import prune_requests
+
+# periodic schedules are created by migrations 0008_periodic_tasks and 0014_cart_request_pruning
+
+logger = logging.getLogger('tasks')
+
+def send_report_mail(orders,start,end):
+	email_from = settings.EMAIL_HOST_USER
+	subject="orders report"
+	report = order_report(orders)
+	adminhtml = loader.get_template('email/hourlyreport.html')
+	context = {'report':report,'start':start,'end':end}
+	html_content = adminhtml.render(context)
+	adminmsg = EmailMessage(subject,html_content,email_from,[a[1] for a in settings.ADMINS])
+	adminmsg.content_subtype = "html"
+	if report['orders']:
+		adminmsg.attach('orders-%s.csv.gz' % start.strftime('%Y%m%d%H%M'), orders_csv_gz(orders), 'application/gzip')
+	adminmsg.send()
+
+@shared_task
+def send_hourly_email():
+	end_time = timezone.now()
+	start_time = end_time-timedelta(hours=1)
+	logger.info('sending hourly report for %s - %s', start_time, end_time)
+	orders_in_past_hour=Order.objects.filter(order_date__gte=start_time,order_date__lte=end_time)
+	send_report_mail(orders_in_past_hour,start_time,end_time)
+
+@shared_task
+def update_sales_rollups():
+	start = update_rollups()
+	logger.info('sales rollups updated from %s', start)
+
+@shared_task
+def prune_cart_requests():
+	deleted = prune_requests()
+	logger.info('pruned %d stored cart batch responses', deleted)
+
+@shared_task
+def make_photo_variants(product_id):
+	process_product_image(product_id)
+
+def html_message(subject,template,context,recipients):
+	message = EmailMessage(subject,template.render(context),settings.EMAIL_HOST_USER,recipients)
+	message.content_subtype = "html"
+	return message
+
+def send_messages(messages,retries=3,delay=2):
+	"""
+	Sends every message over one SMTP connection. A message that fails is
+	retried on a fresh connection, the ones still failing after the last
+	attempt are returned.
+	"""
+	pending = list(messages)
+	for attempt in range(retries):
+		failed = []
+		connection = get_connection()
+		try:
+			connection.open()
+			for message in pending:
+				try:
+					connection.send_messages([message])
+				except (smtplib.SMTPException, socket.error) as e:
+					logger.warning('sending mail to %s failed: %s', message.to, e)
+					failed.append(message)
+		except (smtplib.SMTPException, socket.error) as e:
+			logger.warning('could not connect to the mail server: %s', e)
+			failed = pending
+		finally:
+			connection.close()
+		pending = failed
+		if not pending:
+			break
+		time.sleep(delay*(attempt+1))
+	for message in pending:
+		logger.error('giving up on mail to %s', message.to)
+	return pending
+
+@shared_task
+def send_confirmation_email(id,orders):
+	order_list = list(Order.objects.filter(id__in=orders).select_related('user','product','product__created_by').order_by('id'))
+	if not order_list:
+		return
+	user = order_list[0].user
+	subject='order placed'
+	buyerhtml = loader.get_template('email/orderconfirmation.html')
+	adminhtml = loader.get_template('email/responsetoadmin.html')
+	sellerhtml = loader.get_template('email/responsetoseller.html')
+
+	context = {'username':user.username,'object_list':order_list}
+	messages = [
+		html_message(subject,buyerhtml,context,[user.email]),
+		html_message(subject,adminhtml,context,[a[1] for a in settings.ADMINS]),
+	]
+	sellers = OrderedDict()
+	for order in order_list:
+		sellers.setdefault(order.product.created_by, []).append(order)
+	for seller, seller_orders in sellers.items():
+		context = {'username':user.username,'orders_list':seller_orders,'seller':seller.username}
+		messages.append(html_message(subject,sellerhtml,context,[seller.email]))
+	send_messages(messages)
@@ -1,5 +1,7 @@
 from django import template
 from ..models import CartUser,Cart,Order
+from ..images import photo_url
+from ..identity import get_identity
 
 # template tags
 register = template.Library()
@@ -8,25 +10,32 @@ register = template.Library()
 def multiply(qty, price):
     return qty*price
 
-@register.simple_tag
-def items_in_cart(userid):
-	count = 0
-	try:
-		user = CartUser.objects.get(id=userid)
-		count = len(Cart.objects.filter(user=user,status=Cart.Inorder))
-	except CartUser.DoesNotExist:
-		pass
-	return count
+@register.filter
+def photo(product, variant):
+	return photo_url(product, variant)
 
-@register.simple_tag
-def items_in_order(userid):
-	count = 0
-	try:
-		user = CartUser.objects.get(id=userid)
-		count = len(Order.objects.filter(user=user,status=Order.Notplaced))
-	except CartUser.DoesNotExist:
-		pass
-	return count
+def request_identity(context, userid):
+	# the signed in user's own details come from the request, not the database
+	request = context.get('request')
+	if request is not None:
+		identity = get_identity(request)
+		if identity.is_user(userid):
+			return identity
+	return None
+
+@register.simple_tag(takes_context=True)
+def items_in_cart(context, userid):
+	identity = request_identity(context, userid)
+	if identity is not None:
+		return identity.items_in_cart
+	return Cart.objects.filter(user_id=userid,status=Cart.Inorder).count()
+
+@register.simple_tag(takes_context=True)
+def items_in_order(context, userid):
+	identity = request_identity(context, userid)
+	if identity is not None:
+		return identity.items_in_order
+	return Order.objects.filter(user_id=userid,status=Order.Notplaced).count()
 
 @register.simple_tag
 def totprice(object_list):
@@ -35,7 +44,10 @@ def totprice(object_list):
         total += order.quantity*order.product.cost
     return total
 
-@register.simple_tag
-def address(userid):
+@register.simple_tag(takes_context=True)
+def address(context, userid):
+    identity = request_identity(context, userid)
+    if identity is not None:
+        return identity.address
     user=CartUser.objects.get(id=userid)
     return user.address
@@ -1,3 +1,734 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import io
+import importlib
+import tempfile
+import shutil
+import socket
+import threading
+from datetime import timedelta
+from unittest import mock, skipIf
+from django.conf import settings
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase,TransactionTestCase,RequestFactory
+from django.test.utils import CaptureQueriesContext,override_settings
+from django.db import connection,connections
+from django.urls import reverse
+from django.utils import timezone
+from qbcart.env import LazyList,resolve_hosts
+from .models import CartUser,Product,Cart,Order,ProductFacet,SalesRollup,RollupMark,StoredBlob,CartRequest
+from .context_processors import HeaderCounts
+from .stock import reserve_stock
+from .searchindex import InvertedIndex
+from .reports import order_report,orders_csv_gz
+from . import rollups
+from .tasks import send_confirmation_email
+from .images import process_product_image,photo_url
+from .storage import photo_storage,is_immutable
+from . import productcache, tasks, qbcartlogger, cartbatch, images
 
 # Create your tests here.
+class QueryBudgetMixin(object):
+	"""
+	Renders a page and checks the number of queries stays under a budget
+	and does not grow with the number of rows listed.
+	"""
+
+	def count_queries(self, url):
+		with CaptureQueriesContext(connection) as context:
+			response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		return len(context.captured_queries)
+
+	def assertQueryBudget(self, url, budget, grow):
+		small = self.count_queries(url)
+		grow()
+		large = self.count_queries(url)
+		self.assertLessEqual(small, budget, '%s ran %d queries, budget is %d' % (url, small, budget))
+		self.assertEqual(small, large, '%s query count grows with rows (%d -> %d)' % (url, small, large))
+
+class ListViewQueryTests(QueryBudgetMixin, TestCase):
+
+	def setUp(self):
+		self.seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		self.buyer = CartUser.objects.create_user(username='admin', password='pass', address='home')
+		self.add_rows(3)
+		self.client.force_login(self.buyer)
+
+	def add_rows(self, count):
+		for i in range(count):
+			product = Product.objects.create(
+				name='product', cost=10, stock=100,
+				photo='productimage/p.jpg', created_by=self.seller)
+			Cart.objects.create(user=self.buyer, product=product, status=Cart.Inorder)
+			Order.objects.create(user=self.buyer, product=product, status=Order.Notplaced, price=10)
+			Order.objects.create(user=self.buyer, product=product, status=Order.Placed, price=10)
+
+	def grow(self):
+		self.add_rows(10)
+
+	def test_cart_detail_view(self):
+		self.assertQueryBudget(reverse('viewcart'), 10, self.grow)
+
+	def test_create_order(self):
+		self.assertQueryBudget(reverse('placeorder'), 10, self.grow)
+
+	def test_view_order(self):
+		self.assertQueryBudget(reverse('vieworder'), 10, self.grow)
+
+	def test_order_admin(self):
+		self.assertQueryBudget(reverse('orderadmin'), 6, self.grow)
+
+	def test_cart_admin(self):
+		self.assertQueryBudget(reverse('cartadmin'), 6, self.grow)
+
+	def test_product_admin(self):
+		self.assertQueryBudget(reverse('productadmin'), 6, self.grow)
+
+class HeaderCountsTests(TestCase):
+
+	def test_counts_use_one_query_per_request(self):
+		user = CartUser.objects.create_user(username='buyer', password='pass')
+		product = Product.objects.create(name='product', cost=10, stock=1, photo='productimage/p.jpg', created_by=user)
+		wished = Product.objects.create(name='wished', cost=10, stock=1, photo='productimage/p.jpg', created_by=user)
+		Cart.objects.create(user=user, product=product, status=Cart.Inorder)
+		Cart.objects.create(user=user, product=wished, status=Cart.Incart)
+		Order.objects.create(user=user, product=product, status=Order.Notplaced)
+		request = RequestFactory().get('/')
+		request.user = user
+		with self.assertNumQueries(1):
+			counts = HeaderCounts(request)
+			self.assertEqual((counts.cart, counts.order), (1, 1))
+			self.assertEqual(HeaderCounts(request).cart, 1)
+
+class StorefrontFlowQueryTests(TestCase):
+	"""
+	Query budget of every storefront action. The signed in user is loaded
+	once by the session and once more for the header counts, no action
+	may read it again.
+	"""
+
+	USER_READS = 2
+
+	def setUp(self):
+		productcache.get_cache().clear()
+		self.seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		self.buyer = CartUser.objects.create_user(username='buyer', password='pass', address='home')
+		self.product = Product.objects.create(name='lamp', cost=10, stock=100, photo='productimage/p.jpg', created_by=self.seller)
+		self.other = Product.objects.create(name='desk', cost=20, stock=100, photo='productimage/p.jpg', created_by=self.seller)
+		self.cart = Cart.objects.create(user=self.buyer, product=self.product, status=Cart.Inorder)
+		self.order = Order.objects.create(user=self.buyer, product=self.other, status=Order.Placed, quantity=1, price=20)
+
+	def assertFlow(self, user, url, budget):
+		self.client.force_login(user)
+		with CaptureQueriesContext(connection) as context:
+			response = self.client.get(url)
+		self.assertIn(response.status_code, (200, 302))
+		queries = [query['sql'] for query in context.captured_queries]
+		self.assertLessEqual(len(queries), budget, '%s ran %d queries, budget is %d' % (url, len(queries), budget))
+		user_reads = [sql for sql in queries if sql.startswith('SELECT') and 'FROM "basecart_cartuser"' in sql]
+		self.assertLessEqual(len(user_reads), self.USER_READS, '%s read the user %d times' % (url, len(user_reads)))
+		return response
+
+	def test_index(self):
+		self.assertFlow(self.buyer, reverse('index'), 4)
+
+	def test_add_to_cart(self):
+		self.assertFlow(self.buyer, reverse('index')+'?addcart=%d&qty=1&key=1' % self.other.id, 9)
+		self.assertTrue(Cart.objects.filter(user=self.buyer, product=self.other).exists())
+
+	def test_product_detail(self):
+		self.assertFlow(self.buyer, reverse('productdetail', args=[self.product.id]), 4)
+
+	def test_my_products(self):
+		self.assertFlow(self.seller, reverse('myproducts'), 4)
+
+	def test_view_cart(self):
+		self.assertFlow(self.buyer, reverse('viewcart'), 5)
+
+	def test_update_cart_quantity(self):
+		self.assertFlow(self.buyer, reverse('viewcart')+'?qty=3&id=%d' % self.cart.id, 8)
+		self.cart.refresh_from_db()
+		self.assertEqual(self.cart.quantity, 3)
+
+	def test_move_to_wishlist(self):
+		self.assertFlow(self.buyer, reverse('viewcart')+'?status=1&id=%d' % self.cart.id, 8)
+		self.cart.refresh_from_db()
+		self.assertEqual(self.cart.status, Cart.Incart)
+
+	def test_delete_from_cart(self):
+		self.assertFlow(self.buyer, reverse('viewcart')+'?delcart=%d' % self.cart.id, 9)
+		self.assertFalse(Cart.objects.filter(id=self.cart.id).exists())
+
+	def test_checkout(self):
+		self.assertFlow(self.buyer, reverse('placeorder')+'?checkout=%d' % self.buyer.id, 10)
+		self.assertTrue(Order.objects.filter(user=self.buyer, product=self.product, status=Order.Notplaced).exists())
+
+	def test_checkout_updates_every_pending_order(self):
+		Cart.objects.filter(id=self.cart.id).update(quantity=3)
+		for i in range(2):
+			Order.objects.create(user=self.buyer, product=self.product, status=Order.Notplaced, quantity=1, price=10)
+		self.assertFlow(self.buyer, reverse('placeorder')+'?checkout=%d' % self.buyer.id, 10)
+		self.assertEqual(list(Order.objects.filter(product=self.product).values_list('quantity','price')), [(3, 30), (3, 30)])
+
+	def test_set_address(self):
+		Order.objects.create(user=self.buyer, product=self.product, status=Order.Notplaced, quantity=1, price=10)
+		response = self.assertFlow(self.buyer, reverse('placeorder')+'?address=office', 6)
+		self.assertContains(response, 'office')
+		self.buyer.refresh_from_db()
+		self.assertEqual(self.buyer.address, 'office')
+
+	def test_delete_order(self):
+		order = Order.objects.create(user=self.buyer, product=self.product, status=Order.Notplaced, quantity=1, price=10)
+		self.assertFlow(self.buyer, reverse('placeorder')+'?delorder=%d' % order.id, 11)
+		self.assertFalse(Order.objects.filter(id=order.id).exists())
+
+	def test_place_order(self):
+		Order.objects.create(user=self.buyer, product=self.product, status=Order.Notplaced, quantity=1, price=10)
+		# the confirmation mail is sent by the worker, outside the request
+		with mock.patch.object(send_confirmation_email, 'delay') as delay:
+			self.assertFlow(self.buyer, reverse('vieworder')+'?deliver=%d' % self.buyer.id, 12)
+		self.assertEqual(delay.call_count, 1)
+		self.assertFalse(Order.objects.filter(user=self.buyer, status=Order.Notplaced).exists())
+
+	def test_cancel_order(self):
+		self.assertFlow(self.buyer, reverse('vieworder')+'?cancel=%d' % self.order.id, 12)
+		self.order.refresh_from_db()
+		self.assertEqual(self.order.status, Order.Cancelled)
+
+	def test_cancel_order_of_another_user(self):
+		self.client.force_login(self.seller)
+		self.client.get(reverse('vieworder')+'?cancel=%d' % self.order.id)
+		self.order.refresh_from_db()
+		self.other.refresh_from_db()
+		self.assertEqual((self.order.status, self.other.stock), (Order.Placed, 100))
+
+	def test_remove_cancelled_order(self):
+		Order.objects.filter(id=self.order.id).update(status=Order.Cancelled)
+		self.assertFlow(self.buyer, reverse('vieworder')+'?remove=%d' % self.order.id, 8)
+		self.assertFalse(Order.objects.filter(id=self.order.id).exists())
+
+	def test_address_tag_reuses_request_user(self):
+		from django.template import Context, Template
+		request = RequestFactory().get('/')
+		request.user = self.buyer
+		template = Template('{% load basecart_extras %}{% address user.id %}|{% items_in_cart user.id %}|{% items_in_order user.id %}')
+		with self.assertNumQueries(1):
+			self.assertEqual(template.render(Context({'request':request, 'user':self.buyer})), 'home|1|0')
+		# somebody else's details are still read from the database
+		with self.assertNumQueries(3):
+			self.assertEqual(template.render(Context({'request':request, 'user':self.seller})), '|0|0')
+
+class LogPublisherTests(TestCase):
+
+	def test_tests_do_not_connect_to_the_broker(self):
+		self.assertIsInstance(qbcartlogger.get_publisher(), qbcartlogger.MemoryPublisher)
+		self.assertTrue(qbcartlogger.logbatch([{'action':'test'}]))
+		self.assertEqual(json.loads(qbcartlogger.get_publisher().messages[-1]), [{'action':'test'}])
+
+	def test_closing_counts_every_discarded_message(self):
+		publisher = qbcartlogger.LogPublisher(pool_size=0, buffer_size=10)
+		for i in range(3):
+			publisher.publish('message')
+		self.assertEqual(publisher._discard(), 3)
+		self.assertEqual(publisher.stats()['pending'], 0)
+
+class LogConsumerTests(TestCase):
+
+	def test_malformed_events_are_skipped_one_by_one(self):
+		import qbcartlogconsumer
+		event = {'user':'buyer', 'email':'', 'product':'lamp', 'comments':'', 'action':1, 'date_time':'2018-06-01T10:00:00+00:00'}
+		body = json.dumps([event, 5, dict(event, date_time=5), 'text']).encode('utf8')
+		self.assertEqual([log.product for log in qbcartlogconsumer.build_logs(body)], ['lamp'])
+		for body in (b'5', b'"text"', json.dumps(dict(event, date_time=[])).encode('utf8')):
+			with self.assertRaises(qbcartlogconsumer.MALFORMED):
+				qbcartlogconsumer.build_logs(body)
+
+class StockReservationTests(TestCase):
+
+	def setUp(self):
+		seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		self.first = Product.objects.create(name='first', cost=10, stock=5, photo='productimage/p.jpg', created_by=seller)
+		self.second = Product.objects.create(name='second', cost=10, stock=1, photo='productimage/p.jpg', created_by=seller)
+
+	def test_failure_rolls_back_whole_order(self):
+		report = reserve_stock({self.first.id:2, self.second.id:3})
+		self.assertFalse(report.ok)
+		self.assertEqual(report.failed[self.second.id], {'name':'second','requested':3,'available':1})
+		self.first.refresh_from_db()
+		self.assertEqual(self.first.stock, 5)
+
+	def test_partial_reservation(self):
+		report = reserve_stock({self.first.id:2, self.second.id:3}, partial=True)
+		self.assertEqual(report.reserved, {self.first.id:2})
+		self.first.refresh_from_db()
+		self.assertEqual(self.first.stock, 3)
+
+@skipIf(connection.vendor == 'sqlite', 'needs a database that supports concurrent connections')
+class StockConcurrencyTests(TransactionTestCase):
+
+	def test_parallel_checkouts_never_oversell(self):
+		seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		product = Product.objects.create(name='product', cost=10, stock=10, photo='productimage/p.jpg', created_by=seller)
+		results = []
+		start = threading.Barrier(25)
+
+		def checkout():
+			try:
+				start.wait()
+				results.append(reserve_stock({product.id:1}).ok)
+			finally:
+				connections.close_all()
+
+		threads = [threading.Thread(target=checkout) for i in range(25)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		product.refresh_from_db()
+		self.assertEqual(results.count(True), 10)
+		self.assertEqual(product.stock, 0)
+
+class KeysetPaginationTests(TestCase):
+
+	def setUp(self):
+		self.user = CartUser.objects.create_user(username='buyer', password='pass')
+		product = Product.objects.create(name='product', cost=10, stock=1, photo='productimage/p.jpg', created_by=self.user)
+		for i in range(5):
+			Order.objects.create(user=self.user, product=product, quantity=1)
+		self.client.force_login(self.user)
+
+	def test_pages_cover_every_order_once(self):
+		seen = []
+		totals = []
+		url = reverse('order')+'?page_size=2'
+		response = self.client.get(url)
+		while True:
+			self.assertEqual(response.status_code, 200)
+			seen += [order['id'] for order in response.json()['data']]
+			totals.append(response.json().get('total'))
+			if 'X-Next-Cursor' not in response:
+				break
+			response = self.client.get(url+'&cursor='+response['X-Next-Cursor'])
+		self.assertEqual(sorted(seen), sorted(Order.objects.values_list('id', flat=True)))
+		self.assertEqual(len(seen), 5)
+		# later pages skip the SUM over every order
+		self.assertEqual(totals, [50, None, None])
+
+	def test_stream_keeps_envelope(self):
+		response = self.client.get(reverse('order')+'?stream=1')
+		body = json.loads(b''.join(response.streaming_content).decode('utf8'))
+		self.assertEqual(len(body['data']), 5)
+		self.assertEqual((body['status'], body['error'], body['total']), ('ok', '', 50))
+
+	def test_bad_cursor(self):
+		response = self.client.get(reverse('order')+'?cursor=nonsense')
+		self.assertEqual(response.status_code, 400)
+
+class ProductCacheTests(TestCase):
+
+	def setUp(self):
+		productcache.get_cache().clear()
+		seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		self.product = Product.objects.create(name='lamp', cost=10, stock=5, photo='productimage/p.jpg', created_by=seller)
+
+	def test_second_read_is_a_hit(self):
+		with self.assertNumQueries(1):
+			productcache.get_product(self.product.id)
+			record = productcache.get_product(self.product.id)
+		self.assertEqual(productcache.as_product(record).name, 'lamp')
+
+	def test_save_invalidates(self):
+		productcache.get_product(self.product.id)
+		self.assertEqual(len(productcache.get_catalog()), 1)
+		self.product.name = 'desk lamp'
+		self.product.save()
+		self.assertEqual(productcache.get_product(self.product.id)['name'], 'desk lamp')
+		self.assertEqual(productcache.get_catalog()[0]['name'], 'desk lamp')
+
+	def test_stale_entry_is_served_while_refreshing(self):
+		key = 'product:%s:%s' % (self.product.id, productcache.version('product:%s' % self.product.id))
+		productcache.get_cache().set(key, ('old', 0))
+		productcache.get_cache().add(key+':lock', 1)
+		with self.assertNumQueries(0):
+			self.assertEqual(productcache.get_product(self.product.id), 'old')
+
+	def test_only_pages_handed_out_are_cached(self):
+		def load():
+			loads.append(1)
+			return ['page'], 'next'
+		loads = []
+		self.assertEqual(productcache.get_catalog_page(None, None, load), (['page'], 'next'))
+		self.assertEqual(productcache.get_catalog_page('next', None, load), (['page'], 'next'))
+		productcache.get_catalog_page('next', None, load)
+		self.assertEqual(len(loads), 2)
+		# cursors and page sizes made up by the client are never cached
+		for cursor, page_size in (('made up', None), ('next', '7')):
+			productcache.get_catalog_page(cursor, page_size, load)
+			productcache.get_catalog_page(cursor, page_size, load)
+		self.assertEqual(len(loads), 6)
+
+class ProductSearchTests(TestCase):
+
+	def setUp(self):
+		seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		self.lamp = Product.objects.create(name='desk lamp', description='warm light', cost=500, stock=1,
+			photo='productimage/p.jpg', category=Product.Home, created_by=seller)
+		self.phone = Product.objects.create(name='phone', description='comes with a lamp app', cost=9000, stock=1,
+			photo='productimage/p.jpg', category=Product.Electronics, created_by=seller)
+
+	def search(self, params):
+		response = self.client.get(reverse('productsearch'), params)
+		self.assertEqual(response.status_code, 200)
+		return [product['id'] for product in response.json()['data']]
+
+	def test_matches_name_and_description(self):
+		self.assertEqual(set(self.search({'q':'lamp'})), {self.lamp.id, self.phone.id})
+
+	def test_category_and_price_filters(self):
+		self.assertEqual(self.search({'q':'lamp', 'category':Product.Home}), [self.lamp.id])
+		self.assertEqual(self.search({'q':'lamp', 'max_cost':1000}), [self.lamp.id])
+
+class InvertedIndexTests(TestCase):
+
+	def setUp(self):
+		self.index = InvertedIndex()
+		self.index.build([
+			(1, 'Desk lamp', 'warm light', Product.Home, 500),
+			(2, 'phone', 'comes with a lamp app', Product.Electronics, 9000),
+			(3, 'lampshade', '', Product.Home, 100),
+		])
+
+	def test_prefix_and_ranking(self):
+		self.assertEqual(self.index.search('lam'), [1, 3, 2])
+		self.assertEqual(self.index.search('desk la'), [1])
+
+	def test_filters(self):
+		self.assertEqual(self.index.search('lamp', max_cost=1000), [1, 3])
+		self.assertEqual(self.index.search('lamp', category=Product.Electronics), [2])
+
+	def test_incremental_updates(self):
+		self.index.remove(1)
+		self.index.add(2, 'tablet', '', Product.Electronics, 1)
+		self.index.add(4, 'lamp post', '', Product.Home, 50)
+		self.assertEqual(self.index.search('lamp'), [3, 4])
+		self.assertNotIn('desk', self.index.terms)
+
+class ProductFacetTests(TestCase):
+
+	def setUp(self):
+		self.seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		productcache.get_cache().clear()
+
+	def facets(self):
+		response = self.client.get(reverse('productfacets'))
+		self.assertEqual(response.status_code, 200)
+		data = response.json()['data']
+		categories = dict((facet['category'], facet['count']) for facet in data['categories'])
+		cost = dict((facet['min'], facet['count']) for facet in data['cost'])
+		return categories, cost
+
+	def test_counts_follow_product_changes(self):
+		lamp = Product.objects.create(name='lamp', cost=450, stock=1, photo='productimage/p.jpg', category=Product.Home, created_by=self.seller)
+		Product.objects.create(name='tv', cost=20000, stock=1, photo='productimage/p.jpg', category=Product.Electronics, created_by=self.seller)
+		self.assertEqual(self.facets(), ({Product.Home:1, Product.Electronics:1}, {0:1, 10000:1}))
+		lamp.cost = 700
+		lamp.category = Product.Electronics
+		lamp.save()
+		self.assertEqual(self.facets(), ({Product.Electronics:2}, {500:1, 10000:1}))
+		lamp.delete()
+		self.assertEqual(self.facets(), ({Product.Electronics:1}, {10000:1}))
+
+	def test_rebuild_matches_incremental_counts(self):
+		from . import facets
+		Product.objects.create(name='lamp', cost=450, stock=1, photo='productimage/p.jpg', category=Product.Home, created_by=self.seller)
+		incremental = sorted(ProductFacet.objects.filter(count__gt=0).values_list('kind','value','count'))
+		facets.rebuild()
+		self.assertEqual(sorted(ProductFacet.objects.values_list('kind','value','count')), incremental)
+
+class ConfirmationEmailTests(TestCase):
+
+	def test_one_query_and_one_mail_per_seller(self):
+		buyer = CartUser.objects.create_user(username='buyer', password='pass', email='buyer@example.com')
+		orders = []
+		for name in ('first', 'second'):
+			seller = CartUser.objects.create_user(username=name, password='pass', email=name+'@example.com', role=CartUser.Seller)
+			for i in range(2):
+				product = Product.objects.create(name=name, cost=10, stock=1, photo='productimage/p.jpg', created_by=seller)
+				orders.append(Order.objects.create(user=buyer, product=product, quantity=2).id)
+		with self.assertNumQueries(1):
+			send_confirmation_email(buyer.id, orders)
+		self.assertEqual(len(mail.outbox), 4)
+		self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+		self.assertIn('Rs.80', mail.outbox[0].body)
+		self.assertEqual(sorted(message.to[0] for message in mail.outbox[2:]), ['first@example.com', 'second@example.com'])
+
+class OrderReportTests(TestCase):
+
+	def setUp(self):
+		buyer = CartUser.objects.create_user(username='buyer', password='pass')
+		for name, cost in (('first', 10), ('second', 30)):
+			seller = CartUser.objects.create_user(username=name, password='pass', role=CartUser.Seller)
+			product = Product.objects.create(name=name, cost=cost, stock=5, photo='productimage/p.jpg', created_by=seller)
+			Order.objects.create(user=buyer, product=product, quantity=2, status=Order.Placed)
+			Order.objects.create(user=buyer, product=product, quantity=1)
+
+	def test_totals_come_from_aggregates(self):
+		with self.assertNumQueries(4):
+			report = order_report(Order.objects.all(), top=1)
+		self.assertEqual((report['orders'], report['quantity'], report['revenue']), (4, 6, 120))
+		self.assertEqual([row['status'] for row in report['by_status']], sorted([Order.Notplaced, Order.Placed]))
+		self.assertEqual([row['product__created_by__username'] for row in report['top_sellers']], ['second'])
+		self.assertEqual(report['top_products'][0]['revenue'], 90)
+
+	def test_csv_lists_every_order(self):
+		rows = list(csv.reader(gzip.decompress(orders_csv_gz(Order.objects.all())).decode('utf8').splitlines()))
+		self.assertEqual(len(rows), 5)
+		self.assertEqual(rows[0][0], 'id')
+
+class SalesRollupTests(TestCase):
+
+	def setUp(self):
+		buyer = CartUser.objects.create_user(username='buyer', password='pass')
+		self.seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		self.product = Product.objects.create(name='lamp', cost=10, stock=5, photo='productimage/p.jpg', created_by=self.seller, category=Product.Home)
+		self.orders = [Order.objects.create(user=buyer, product=self.product, quantity=2, status=Order.Placed) for i in range(3)]
+
+	def placed(self, dimension, period=SalesRollup.Daily):
+		return rollups.sales_totals(period, dimension)
+
+	def test_rollups_match_orders(self):
+		rollups.update_rollups()
+		self.assertEqual(RollupMark.objects.get(name=rollups.MARK).order_id, self.orders[-1].id)
+		for dimension, key in ((SalesRollup.Product, self.product.id), (SalesRollup.Seller, self.seller.id), (SalesRollup.Category, Product.Home)):
+			for period in (SalesRollup.Hourly, SalesRollup.Daily):
+				self.assertEqual(self.placed(dimension, period), [{'key':key, 'orders':3, 'quantity':6, 'revenue':60}])
+
+	def test_recent_status_changes_are_picked_up(self):
+		rollups.update_rollups()
+		Order.objects.filter(id=self.orders[0].id).update(status=Order.Cancelled)
+		rollups.update_rollups()
+		self.assertEqual(self.placed(SalesRollup.Product)[0]['orders'], 2)
+		self.assertEqual(rollups.sales_totals(SalesRollup.Daily, SalesRollup.Product, status=Order.Cancelled)[0]['orders'], 1)
+
+	def test_late_cancellations_are_picked_up(self):
+		old = timezone.now()-timedelta(days=3)
+		Order.objects.filter(id=self.orders[0].id).update(order_date=old, updated=old)
+		rollups.update_rollups()
+		self.assertEqual(self.placed(SalesRollup.Product)[0]['orders'], 3)
+		Order.objects.filter(id=self.orders[0].id).update(status=Order.Cancelled, updated=timezone.now())
+		rollups.update_rollups(timezone.now()+timedelta(hours=1))
+		self.assertEqual(self.placed(SalesRollup.Product)[0]['orders'], 2)
+
+	def test_queries_read_rollups_only(self):
+		rollups.update_rollups()
+		with self.assertNumQueries(1):
+			rollups.sales_series(SalesRollup.Hourly, SalesRollup.Seller, keys=[self.seller.id])
+
+class CartBatchTests(TestCase):
+
+	def setUp(self):
+		self.buyer = CartUser.objects.create_user(username='buyer', password='pass')
+		seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		self.products = [Product.objects.create(name='p%d' % i, cost=10, stock=5, photo='productimage/p.jpg', created_by=seller) for i in range(3)]
+		Cart.objects.create(user=self.buyer, product=self.products[2], quantity=1)
+		self.client.force_login(self.buyer)
+
+	def post(self, operations, key=''):
+		return self.client.post(reverse('cartbatch'), json.dumps({'operations':operations}),
+			content_type='application/json', HTTP_IDEMPOTENCY_KEY=key)
+
+	def test_operations_apply_in_order(self):
+		first, second, third = [product.id for product in self.products]
+		response = self.post([
+			{'op':'add', 'product':first, 'quantity':2},
+			{'op':'add', 'product':first},
+			{'op':'update', 'product':second, 'quantity':4},
+			{'op':'remove', 'product':third},
+			{'op':'add', 'product':0},
+		])
+		self.assertEqual(response.status_code, 200)
+		results = response.json()['data']['results']
+		self.assertEqual([result['status'] for result in results], ['ok', 'ok', 'fail', 'ok', 'fail'])
+		self.assertEqual(results[1]['data']['quantity'], 3)
+		self.assertEqual(dict(Cart.objects.filter(user=self.buyer).values_list('product','quantity')), {first:3})
+
+	def test_retry_with_same_key_is_replayed(self):
+		operations = [{'op':'add', 'product':self.products[0].id, 'quantity':2}]
+		first = self.post(operations, key='sync-1').json()['data']
+		second = self.post(operations, key='sync-1').json()['data']
+		self.assertFalse(first['replayed'])
+		self.assertTrue(second['replayed'])
+		self.assertEqual(first['results'], second['results'])
+		self.assertEqual(Cart.objects.get(user=self.buyer, product=self.products[0]).quantity, 2)
+		self.assertEqual(self.post([{'op':'remove', 'product':self.products[0].id}], key='sync-1').status_code, 409)
+
+	def test_old_responses_are_pruned(self):
+		operations = [{'op':'add', 'product':self.products[0].id}]
+		self.post(operations, key='old')
+		self.post(operations, key='new')
+		CartRequest.objects.filter(key='old').update(created=timezone.now()-timedelta(hours=cartbatch.RETENTION_HOURS+1))
+		self.assertEqual(cartbatch.prune_requests(batch_size=1), 1)
+		self.assertEqual(list(CartRequest.objects.values_list('key', flat=True)), ['new'])
+
+class ProductImportTests(TestCase):
+
+	def setUp(self):
+		self.media = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media)
+		media_root = override_settings(MEDIA_ROOT=self.media)
+		media_root.enable()
+		self.addCleanup(media_root.disable)
+		self.seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		self.client.force_login(self.seller)
+		self.lamp = photo_storage.save('productimage/lamp.jpg', ContentFile(b'lamp'))
+		self.book = photo_storage.save('productimage/book.jpg', ContentFile(b'book'))
+
+	def upload(self, name, content):
+		return self.client.post(reverse('productimport'), {'file':SimpleUploadedFile(name, content.encode('utf8'))})
+
+	def test_csv_import_reports_bad_rows(self):
+		response = self.upload('products.csv', 'name,description,cost,stock,photo,category\n'
+			'lamp,desk lamp,100,5,%s,3\n'
+			'chair,,abc,5,%s,3\n'
+			'book,,20,1,%s,5\n'
+			'shelf,,20,1,productimage/shelf.jpg,3\n' % (self.lamp, self.lamp, self.book))
+		data = response.json()['data']
+		self.assertEqual((data['created'], data['failed']), (2, 2))
+		self.assertEqual([error['line'] for error in data['errors']], [3, 5])
+		self.assertIn('cost', data['errors'][0]['errors'])
+		self.assertIn('photo', data['errors'][1]['errors'])
+		self.assertEqual(StoredBlob.objects.get(name=self.lamp).refs, 2)
+		self.assertEqual(Product.objects.filter(created_by=self.seller).count(), 2)
+		self.assertEqual(ProductFacet.objects.get(kind=ProductFacet.Category, value=Product.Home).count, 1)
+
+	def test_rows_whose_photo_was_removed_are_rejected(self):
+		gone = photo_storage.save('productimage/gone.jpg', ContentFile(b'gone'))
+		photo_storage.delete(gone)
+		with CaptureQueriesContext(connection) as queries:
+			data = self.upload('products.csv', 'name,cost,stock,photo,category\n'
+				'lamp,100,5,%s,3\nvase,20,1,%s,3\nbook,20,1,%s,5\n' % (self.lamp, gone, self.book)).json()['data']
+		self.assertEqual((data['created'], data['errors']), (2, [{'line':3, 'errors':{'photo':['photo must name a stored product photo']}}]))
+		self.assertEqual(StoredBlob.objects.get(name=gone).refs, 0)
+		self.assertFalse(Product.objects.filter(name='vase').exists())
+		self.assertEqual(sum('basecart_storedblob' in query['sql'] for query in queries.captured_queries), 2)
+
+	def test_imported_products_get_photo_variants(self):
+		Product.objects.create(name='old', cost=1, stock=1, photo='productimage/old.jpg', created_by=self.seller)
+		with mock.patch('basecart.productio.transaction.on_commit', lambda run: run()), \
+				mock.patch('basecart.productio.queue_photo_variants') as queue:
+			self.upload('products.csv', 'name,cost,stock,photo,category\nlamp,100,5,%s,3\nbook,20,1,%s,5\n' % (self.lamp, self.book))
+		imported = Product.objects.filter(name__in=['lamp','book']).values_list('id', flat=True)
+		self.assertEqual(sorted(queue.call_args[0][0]), sorted(imported))
+
+	def test_export_reads_back(self):
+		self.upload('products.jsonl', json.dumps({'name':'lamp', 'cost':100, 'stock':5, 'photo':self.lamp, 'category':3})+'\nnot json\n')
+		response = self.client.get(reverse('productexport')+'?filetype=jsonl')
+		rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf8').splitlines()]
+		self.assertEqual([row['name'] for row in rows], ['lamp'])
+		self.assertEqual(self.upload('again.csv', b''.join(self.client.get(reverse('productexport')).streaming_content).decode('utf8')).json()['data']['created'], 1)
+
+class ProductImageTests(TestCase):
+
+	def setUp(self):
+		self.media = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media)
+		media_root = override_settings(MEDIA_ROOT=self.media)
+		media_root.enable()
+		self.addCleanup(media_root.disable)
+
+	def photo(self, name):
+		from PIL import Image
+		output = io.BytesIO()
+		Image.new('RGB', (800, 600), 'red').save(output, 'JPEG')
+		return SimpleUploadedFile(name, output.getvalue())
+
+	def test_variants_are_made_once_per_content(self):
+		seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		product = Product.objects.create(name='lamp', cost=10, stock=1, photo=self.photo('lamp.jpg'), created_by=seller)
+		self.assertEqual(photo_url(product, 'thumb'), product.photo.url)
+		made = process_product_image(product.id)
+		product.refresh_from_db()
+		self.assertTrue(made['thumb'].startswith(product.photo.name.rsplit('.', 1)[0]+'.thumb.'))
+		self.assertEqual(photo_url(product, 'thumb'), settings.MEDIA_URL+made['thumb'])
+		from PIL import Image
+		with default_storage.open(made['thumb']) as thumb:
+			self.assertEqual(Image.open(thumb).size, (150, 150))
+		self.assertEqual(process_product_image(product.id), made)
+
+	def test_a_dead_broker_does_not_block_saves(self):
+		from kombu.exceptions import OperationalError
+		with mock.patch.object(images, 'QUEUE', True), \
+				mock.patch.object(tasks.make_photo_variants, 'apply_async', side_effect=OperationalError('refused')) as send, \
+				self.assertLogs('basecart.images', 'WARNING'):
+			self.assertEqual(images.queue_photo_variants([1, 2, 3]), 0)
+		send.assert_called_once_with((1,), retry=False)
+
+class ContentAddressedStorageTests(TestCase):
+
+	def setUp(self):
+		self.media = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.media)
+		media_root = override_settings(MEDIA_ROOT=self.media)
+		media_root.enable()
+		self.addCleanup(media_root.disable)
+
+	def test_same_content_is_stored_once(self):
+		first = photo_storage.save('productimage/a.JPG', ContentFile(b'same bytes'))
+		second = photo_storage.save('productimage/b.jpg', ContentFile(b'same bytes'))
+		other = photo_storage.save('productimage/c.jpg', ContentFile(b'other bytes'))
+		self.assertEqual(first, second)
+		self.assertNotEqual(first, other)
+		self.assertTrue(first.endswith('.jpg') and is_immutable(first))
+		self.assertEqual(StoredBlob.objects.get(name=first).refs, 2)
+		photo_storage.delete(first)
+		self.assertTrue(photo_storage.exists(first))
+		photo_storage.delete(first)
+		self.assertFalse(photo_storage.exists(first))
+		self.assertEqual(photo_storage.save('productimage/d.jpg', ContentFile(b'same bytes')), first)
+		self.assertTrue(photo_storage.exists(first))
+
+	def test_files_without_a_blob_are_kept(self):
+		legacy = default_storage.save('productimage/legacy.jpg', ContentFile(b'old bytes'))
+		seller = CartUser.objects.create_user(username='seller', password='pass', role=CartUser.Seller)
+		Product.objects.create(name='lamp', cost=10, stock=1, photo=legacy, created_by=seller)
+		Product.objects.create(name='desk', cost=10, stock=1, photo=legacy, created_by=seller).delete()
+		self.assertTrue(photo_storage.exists(legacy))
+		photo_storage.delete_legacy(legacy)
+		self.assertFalse(photo_storage.exists(legacy))
+
+	def test_media_is_served_with_cache_headers(self):
+		name = photo_storage.save('productimage/a.jpg', ContentFile(b'bytes'))
+		response = self.client.get(settings.MEDIA_URL+name)
+		self.assertEqual(response.status_code, 200)
+		self.assertIn('immutable', response['Cache-Control'])
+
+class StartupTests(TestCase):
+
+	def test_hosts_are_resolved_on_first_use(self):
+		def gethostbyname(name):
+			if name == 'name.invalid':
+				raise socket.gaierror('name or service not known')
+			return '10.0.0.1'
+		calls = []
+		hosts = LazyList(lambda: calls.append(1) or ['localhost']+resolve_hosts(['name.invalid', 'my_server']))
+		with mock.patch('socket.gethostbyname', gethostbyname):
+			self.assertEqual(calls, [])
+			self.assertIn('localhost', hosts)
+		self.assertEqual(list(hosts), ['localhost', '10.0.0.1'])
+		self.assertEqual(calls, [1])
+
+	def test_lazy_list_behaves_like_a_list(self):
+		hosts = LazyList(lambda: ['localhost', 'example.com'])
+		self.assertEqual(hosts+['testserver'], ['localhost', 'example.com', 'testserver'])
+		self.assertEqual(['testserver']+hosts, ['testserver', 'localhost', 'example.com'])
+		self.assertTrue(hosts == ['localhost', 'example.com'] and ['localhost', 'example.com'] == hosts)
+		self.assertEqual((hosts.index('example.com'), hosts.count('localhost'), hosts.copy()), (1, 1, ['localhost', 'example.com']))
+
+	def test_importing_tasks_runs_no_queries(self):
+		with self.assertNumQueries(0):
+			importlib.reload(tasks)
@@ -9,11 +9,17 @@ api_routes = [
 	path('',schema_view,name='schema'),
 	path('login/',views.login, name='apilogin'),
 	path('product/',views.ProductListOrCreate.as_view(), name='product'),
+	path('product/facets/',views.ProductFacets.as_view(), name='productfacets'),
+	path('product/import/',views.ProductImport.as_view(), name='productimport'),
+	path('product/export/',views.ProductExport.as_view(), name='productexport'),
+	path('product/search/',views.ProductSearch.as_view(), name='productsearch'),
 	path('product/<int:pk>/',views.ProductDetail.as_view(), name='productitem'),
 	path('cart/',views.CartListOrCreate.as_view(), name='cart'),
+	path('cart/batch/',views.CartBatch.as_view(), name='cartbatch'),
 	path('cart/<int:pk>/',views.CartDetail.as_view(), name='cartitem'),
 	path('order/',views.OrderListOrCreate.as_view(), name='order'),
 	path('order/<int:pk>/',views.OrderDetail.as_view(), name='orderitem'),
+	path('sales/',views.SalesRollups.as_view(), name='sales'),
 ]
 
 urlpatterns=[
@@ -4,13 +4,23 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import ListView,DetailView
 from django.views.generic import CreateView, UpdateView
 from django.urls import reverse_lazy
-from .models import CartUser,Product,Cart,Order,CartActivityLogger
+from .models import CartUser,Product,Cart,Order,CartActivityLogger,SalesRollup
 from django.contrib.auth.forms import UserCreationForm
 from django import forms
 from django.utils import timezone
 from datetime import timedelta
 from django.conf import settings
-from .qbcartlogger import logdata
+from .qbcartlogger import logdata,logbatch
+from django.db import transaction
+from django.db.models import Case, When, Value, IntegerField
+from .stock import reserve_stock,release_stock
+from .pagination import list_response
+from . import productcache
+from .search import search_products,parse_filters,has_filters
+from .facets import get_facets
+from . import rollups, cartbatch, productio
+from .storage import is_immutable
+from .identity import get_identity
 import json
 from rest_framework import viewsets
 from .serializers import (
@@ -21,6 +31,9 @@ from .serializers import (
 	CartSerializer,
 	OrderCreateSerializer,
 	OrderSerializer,
+	OrderLineSerializer,
+	CartOperationSerializer,
+	ProductImportSerializer,
 	)
 from rest_framework import status,permissions
 from rest_framework.decorators import api_view,permission_classes
@@ -28,8 +41,9 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from django.http import Http404
+from django.views.static import serve
 from rest_framework.generics import GenericAPIView
-from tasks import send_confirmation_email
+from .tasks import send_confirmation_email
 from django_celery_beat.models import CrontabSchedule, PeriodicTask
 
 # Create your views here.
@@ -99,11 +113,10 @@ class ProductDetail(GenericAPIView):
 				}
 
 		"""
-		try:
-			product = Product.objects.get(pk=pk)
-		except Product.DoesNotExist:
+		record = productcache.get_product(pk)
+		if record is None:
 			return Response({'error':'product does not exist','status':'fail','data':''},status=status.HTTP_404_NOT_FOUND)
-		serializer = ProductDetailSerializer(product)
+		serializer = ProductDetailSerializer(productcache.as_product(record))
 		return Response({'data':serializer.data,'status':'ok','error':''},status=status.HTTP_200_OK)
 
 	def put(self, request, pk, *args, **kwargs):
@@ -237,10 +250,20 @@ class ProductListOrCreate(GenericAPIView):
 
 	def get(self, request, *args, **kwargs):
 		"""
-		lists all products
+		lists products, page by page
 		---
 		# Parameters:
-			None
+			cursor:
+				required:False
+				type:String
+				description: value of the X-Next-Cursor header of the previous page
+			page_size:
+				required:False
+				type:Integer
+			stream:
+				required:False
+				type:Boolean
+				description: stream every product after the cursor as one chunked response
 		# Response:
 			200:
 				{
@@ -259,13 +282,9 @@ class ProductListOrCreate(GenericAPIView):
 				}
 
 	"""
-		try:
-			products = Product.objects.all()
-		except Product.DoesNotExist:
-			return Response({'error':'products list empty','status':'fail','data':''},status=status.HTTP_404_NOT_FOUND)	
-		
-		serializer = ProductSerializer(products, many=True)
-		return Response({'data':serializer.data,'status':'ok','error':''},status=status.HTTP_200_OK)
+		def cached_page(load):
+			return productcache.get_catalog_page(request.query_params.get('cursor'), request.query_params.get('page_size'), load)
+		return list_response(request, Product.objects.for_listing(), ProductSerializer, ('id',), cache=cached_page)
 
 	def post(self, request, *args, **kwargs):
 		"""
@@ -303,6 +322,179 @@ class ProductListOrCreate(GenericAPIView):
 			return Response({'data':serializer.data,'status':'ok','error':''},status=status.HTTP_200_OK)
 		return Response({'error':serializer.errors,'status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
 
+def can_sell(user):
+	return user.is_staff or user.role == CartUser.Seller
+
+@permission_classes((permissions.IsAuthenticated,))
+class ProductImport(GenericAPIView):
+	serializer_class = ProductImportSerializer
+
+	def post(self, request, *args, **kwargs):
+		"""
+		creates products of the seller from an uploaded CSV or JSON lines
+		file, one product per row with the columns name, description, cost,
+		stock, photo and category. photo is the photo field of a product
+		already on the site, as exported. Valid rows are saved, invalid ones are
+		reported with their line number.
+		---
+		# Parameters:
+			file:
+				required:True
+				type:File
+			filetype:
+				required:False
+				type:String
+				description: csv or jsonl, taken from the file name when missing
+		# Response:
+			200:
+				{
+					"data": {
+						"created": integer,
+						"failed": integer,
+						"errors": [
+							{
+								"line": integer,
+								"errors": {"field": ["string"]}
+							},
+						]
+					},
+					"status": "ok",
+					"error": ""
+				}
+
+		"""
+		if not can_sell(request.user):
+			return Response({'error':'only sellers can import products','status':'fail','data':''},status=status.HTTP_403_FORBIDDEN)
+		upload = request.FILES.get('file')
+		if upload is None:
+			return Response({'error':'file is required','status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
+		try:
+			fmt = productio.detect_format(upload.name, request.data.get('filetype'))
+		except productio.InvalidImport as e:
+			return Response({'error':str(e),'status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
+		report = productio.import_products(request.user, upload, fmt)
+		if report.created:
+			logdata(create_json(
+				user=request.user,
+				action=CartActivityLogger.Productcreated,
+				product='%d products' % report.created,
+				comments='imported from '+upload.name))
+		return Response({'data':report.as_dict(),'status':'ok','error':''},status=status.HTTP_200_OK)
+
+@permission_classes((permissions.IsAuthenticated,))
+class ProductExport(GenericAPIView):
+	serializer_class = ProductImportSerializer
+
+	def get(self, request, *args, **kwargs):
+		"""
+		streams the products of the seller as CSV or JSON lines, in the
+		columns the import reads
+		---
+		# Parameters:
+			filetype:
+				required:False
+				type:String
+				description: csv or jsonl, default csv
+		# Response:
+			200:
+				id,name,description,cost,stock,photo,category
+
+		"""
+		if not can_sell(request.user):
+			return Response({'error':'only sellers can export products','status':'fail','data':''},status=status.HTTP_403_FORBIDDEN)
+		try:
+			# not 'format', rest framework takes that one for content negotiation
+			fmt = productio.detect_format('', request.query_params.get('filetype', 'csv'))
+		except productio.InvalidImport as e:
+			return Response({'error':str(e),'status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
+		return productio.export_response(Product.objects.filter(created_by=request.user), fmt)
+
+@permission_classes((permissions.IsAuthenticatedOrReadOnly,))
+class ProductSearch(GenericAPIView):
+	serializer_class = ProductSerializer
+
+	def get(self, request, *args, **kwargs):
+		"""
+		searches products by name and description, best match first
+		---
+		# Parameters:
+			q:
+				required:False
+				type:String
+			category:
+				required:False
+				type:Integer
+			min_cost:
+				required:False
+				type:Integer
+			max_cost:
+				required:False
+				type:Integer
+			limit:
+				required:False
+				type:Integer
+		# Response:
+			200:
+				{
+					"data":
+						[
+							{
+								"id": integer,
+								"name": "string",
+								"cost": integer,
+								"photo": "string",
+								"category": integer,
+							},
+						]
+					"status": "ok",
+					"error": ""
+				}
+
+		"""
+		try:
+			limit = max(1, min(int(request.query_params.get('limit', 50)), 200))
+		except ValueError:
+			limit = 50
+		products = search_products(limit=limit, **parse_filters(request.query_params))
+		serializer = ProductSerializer(products, many=True)
+		return Response({'data':serializer.data,'status':'ok','error':''},status=status.HTTP_200_OK)
+
+@permission_classes((permissions.IsAuthenticatedOrReadOnly,))
+class ProductFacets(GenericAPIView):
+	serializer_class = ProductSerializer
+
+	def get(self, request, *args, **kwargs):
+		"""
+		product counts per category and per cost range
+		---
+		# Parameters:
+			None
+		# Response:
+			200:
+				{
+					"data": {
+						"categories": [
+							{
+								"category": integer,
+								"name": "string",
+								"count": integer
+							},
+						],
+						"cost": [
+							{
+								"min": integer,
+								"max": integer,
+								"count": integer
+							},
+						]
+					},
+					"status": "ok",
+					"error": ""
+				}
+
+		"""
+		return Response({'data':get_facets(),'status':'ok','error':''},status=status.HTTP_200_OK)
+
 #cart
 
 @permission_classes((permissions.IsAuthenticated,))
@@ -454,10 +646,20 @@ class CartListOrCreate(GenericAPIView):
 	serializer_class = CartCreateSerializer
 	def get(self, request, *args, **kwargs):
 		"""
-		Lists all Cart entries
+		Lists Cart entries, page by page
 		---
 		# Parameters:
-			None
+			cursor:
+				required:False
+				type:String
+				description: value of the X-Next-Cursor header of the previous page
+			page_size:
+				required:False
+				type:Integer
+			stream:
+				required:False
+				type:Boolean
+				description: stream every entry after the cursor as one chunked response
 		# Response:
 			200:
 				{
@@ -473,15 +675,10 @@ class CartListOrCreate(GenericAPIView):
 				}
 
 		"""
-		try:
-			cart = Cart.objects.all()
-		except Cart.DoesNotExist:
+		cart = Cart.objects.only('id','product','quantity','status')
+		if not cart.exists():
 			return Response({'error':'cart empty','status':'fail','data':''},status=status.HTTP_404_NOT_FOUND)
-		if not cart:
-			return Response({'error':'cart empty','status':'fail','data':''},status=status.HTTP_404_NOT_FOUND)
-		else:
-			serializer = CartSerializer(cart, many=True)
-			return Response({'data':serializer.data,'status':'ok','error':''},status=status.HTTP_200_OK)
+		return list_response(request, cart, CartSerializer, ('id',))
 
 	def post(self, request, *args, **kwargs):
 		"""
@@ -516,6 +713,76 @@ class CartListOrCreate(GenericAPIView):
 			return Response({'data':serializer.data,'status':'ok','error':''},status=status.HTTP_200_OK)
 		return Response({'error':serializer.errors,'status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
 
+@permission_classes((permissions.IsAuthenticated,))
+class CartBatch(GenericAPIView):
+	serializer_class = CartOperationSerializer
+
+	def post(self, request, *args, **kwargs):
+		"""
+		applies a list of add, update and remove operations to the cart of
+		the user in one transaction. add puts quantity more of a product in
+		the cart, update sets quantity or status, remove deletes the line.
+		Send an Idempotency-Key header to make retries safe, a repeated key
+		returns the first response without applying anything again.
+		---
+		# Parameters:
+			Idempotency-Key:
+				required:False
+				type:String
+				paramType:header
+			body:
+				{
+					"operations": [
+						{
+							"op": "add|update|remove",
+							"product": integer,
+							"quantity": integer,
+							"status": "string"
+						},
+					]
+				}
+		# Response:
+			200:
+				{
+					"data": {
+						"results": [
+							{
+								"op": "string",
+								"product": integer,
+								"status": "ok|fail",
+								"error": "string",
+								"data": {
+									"id": integer,
+									"product": integer,
+									"quantity": integer,
+									"status": "string"
+								}
+							},
+						],
+						"replayed": boolean
+					},
+					"status": "ok",
+					"error": ""
+				}
+
+		"""
+		operations = request.data.get('operations') if isinstance(request.data, dict) else None
+		if not isinstance(operations, list) or not operations:
+			return Response({'error':'operations must be a non empty list','status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
+		if len(operations) > cartbatch.MAX_OPERATIONS:
+			return Response({'error':'at most %d operations per request' % cartbatch.MAX_OPERATIONS,'status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
+		serializer = CartOperationSerializer(data=operations, many=True)
+		if not serializer.is_valid():
+			return Response({'error':serializer.errors,'status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
+		key = request.META.get('HTTP_IDEMPOTENCY_KEY', '')[:64]
+		try:
+			results, events, replayed = cartbatch.apply_batch(request.user, [dict(operation) for operation in serializer.validated_data], key)
+		except cartbatch.KeyReused as e:
+			return Response({'error':str(e),'status':'fail','data':''},status=status.HTTP_409_CONFLICT)
+		if events:
+			logbatch([create_log(user=request.user, action=action, product=name, comments=comments) for action, name, comments in events])
+		return Response({'data':{'results':results,'replayed':replayed},'status':'ok','error':''},status=status.HTTP_200_OK)
+
 #order
 @permission_classes((permissions.IsAuthenticated,))
 class OrderDetail(GenericAPIView):
@@ -685,10 +952,20 @@ class OrderListOrCreate(GenericAPIView):
 	
 	def get(self, request, *args, **kwargs):
 		"""
-		returns all orders
+		returns orders, newest first, page by page
 		---
 		# Parameters:
-			None
+			cursor:
+				required:False
+				type:String
+				description: value of the X-Next-Cursor header of the previous page
+			page_size:
+				required:False
+				type:Integer
+			stream:
+				required:False
+				type:Boolean
+				description: stream every order after the cursor as one chunked response
 		# Response:
 			200:
 				{
@@ -698,20 +975,19 @@ class OrderListOrCreate(GenericAPIView):
 						"quantity": integer,
 						"status": "string",
 						"price": integer,
-						"order_date": datetime
+						"order_date": datetime,
+						"line_total": integer
 						},
+					"total": integer, first page only,
 					"status": "ok",
 					"error": ""
 				}
 
 		"""
-		try:
-			order = Order.objects.all()
-		except Order.DoesNotExist:
-			return Response({'error':'order empty','status':'fail','data':''},status=status.HTTP_404_NOT_FOUND)
-		
-		serializer = OrderSerializer(order, many=True)
-		return Response({'data':serializer.data,'status':'ok','error':''},status=status.HTTP_200_OK)
+		order = Order.objects.with_line_total()
+		# the total sums every order, so it is only sent with the first page
+		extra = None if request.query_params.get('cursor') else {'total':order.total()}
+		return list_response(request, order, OrderLineSerializer, ('-order_date','-id'), extra=extra)
 
 	def post(self, request, *args, **kwargs):
 		"""
@@ -747,18 +1023,113 @@ class OrderListOrCreate(GenericAPIView):
 			return Response({'data':serializer.data,'status':'ok','error':''},status=status.HTTP_200_OK)
 		return Response({'error':serializer.errors,'status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
 
+#analytics
+@permission_classes((permissions.IsAuthenticated,))
+class SalesRollups(GenericAPIView):
+	PERIODS = {'hourly':SalesRollup.Hourly, 'daily':SalesRollup.Daily}
+	DIMENSIONS = {'product':SalesRollup.Product, 'seller':SalesRollup.Seller, 'category':SalesRollup.Category}
+
+	def get(self, request, *args, **kwargs):
+		"""
+		returns sales totals from the hourly or daily rollups, per product,
+		seller or category, or per bucket when key is given. Sellers only
+		see their own products.
+		---
+		# Parameters:
+			period:
+				required:False
+				type:String
+				description: hourly or daily, default daily
+			dimension:
+				required:False
+				type:String
+				description: product, seller or category, default product
+			key:
+				required:False
+				type:Integer
+				description: product id, seller id or category
+			start:
+				required:False
+				type:String
+				description: ISO date or datetime, inclusive
+			end:
+				required:False
+				type:String
+				description: ISO date or datetime, exclusive
+			status:
+				required:False
+				type:String
+				description: PL, NP, CN or all, default PL
+			limit:
+				required:False
+				type:Integer
+		# Response:
+			200:
+				{
+					"data":
+						[
+							{
+								"key": integer,
+								"name": "string",
+								"orders": integer,
+								"quantity": integer,
+								"revenue": integer
+							},
+						]
+					"status": "ok",
+					"error": ""
+				}
+
+		"""
+		params = request.query_params
+		period = self.PERIODS.get(params.get('period', 'daily'))
+		dimension = self.DIMENSIONS.get(params.get('dimension', 'product'))
+		if period is None or dimension is None:
+			return Response({'error':'invalid period or dimension','status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
+		statuses = dict(Order.STATUSES)
+		state = params.get('status', Order.Placed)
+		if state != 'all' and state not in statuses:
+			return Response({'error':'invalid status','status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
+		try:
+			start = rollups.parse_moment(params['start']) if params.get('start') else None
+			end = rollups.parse_moment(params['end']) if params.get('end') else None
+			keys = [int(params['key'])] if params.get('key') else None
+			limit = max(1, min(int(params.get('limit', 50)), 1000))
+		except ValueError as e:
+			return Response({'error':str(e),'status':'fail','data':''},status=status.HTTP_400_BAD_REQUEST)
+		user = request.user
+		if not user.is_staff:
+			if user.role != CartUser.Seller or dimension == SalesRollup.Category:
+				return Response({'error':'not allowed','status':'fail','data':''},status=status.HTTP_403_FORBIDDEN)
+			own = [user.id] if dimension == SalesRollup.Seller else list(Product.objects.filter(created_by=user).values_list('id', flat=True))
+			keys = [key for key in keys if key in own] if keys is not None else own
+		filters = dict(start=start, end=end, status=None if state == 'all' else state, keys=keys)
+		if params.get('key'):
+			return Response({'data':rollups.sales_series(period, dimension, **filters),'status':'ok','error':''},status=status.HTTP_200_OK)
+		rows = rollups.sales_totals(period, dimension, limit=limit, **filters)
+		if dimension == SalesRollup.Product:
+			names = dict(Product.objects.filter(id__in=[row['key'] for row in rows]).values_list('id','name'))
+		elif dimension == SalesRollup.Seller:
+			names = dict(CartUser.objects.filter(id__in=[row['key'] for row in rows]).values_list('id','username'))
+		else:
+			names = dict(Product.CATEGORIES)
+		for row in rows:
+			row['name'] = names.get(row['key'], '')
+		return Response({'data':rows,'status':'ok','error':''},status=status.HTTP_200_OK)
+
 # json creator
-def create_json(user,action,product,comments):
+def create_log(user,action,product,comments):
 	data={}
 	data['user']=user.username
 	data['email']=user.email
 	data['action']=action
 	data['product']=product
 	data['comments']=comments
-	data['date_time']=timezone.localtime(timezone.now()).strftime('%Y-%m-%d %H:%M')
-	json_data=json.dumps(data)
-	print(json_data)
-	return json_data
+	data['date_time']=timezone.now().isoformat()
+	return data
+
+def create_json(user,action,product,comments):
+	return json.dumps(create_log(user,action,product,comments))
 
 # basecart functions
 
@@ -770,7 +1141,7 @@ def delete_product(self):
 			name = Product.objects.get(id=productid).name
 			Product.objects.get(id=productid).delete()
 			json_data=create_json(
-				user=CartUser.objects.get(id=self.request.user.id),
+				user=get_identity(self.request).user,
 				action=CartActivityLogger.Productdeleted,
 				product=name,
 				comments='product deleted')
@@ -785,7 +1156,7 @@ def delete_cart_entry(self):
 			cart = Cart.objects.get(id=productid)
 			Cart.objects.get(id=productid).delete()
 			json_data=create_json(
-				user=CartUser.objects.get(id=self.request.user.id),
+				user=get_identity(self.request).user,
 				action=CartActivityLogger.Removedfromcart,
 				product=cart.product.name,
 				comments='delete from cart')
@@ -800,20 +1171,20 @@ def add_cart_entry(self):
 		key = int(self.request.GET.get('key'))
 		try:
 			cart_item = Product.objects.get(pk=productid)
-			user_detail = CartUser.objects.get(id=self.request.user.id)
-			if(check_if_cart_exist_or_new(cart_item,user_detail,key)==0):
+			# the unique (user, product) index makes this safe against double submits
+			cart_entry, created = Cart.objects.get_or_create(user=get_identity(self.request).user, product=cart_item,
+				defaults={'quantity':qty, 'product_key':key})
+			if created:
 				json_data=create_json(
-					user=CartUser.objects.get(id=self.request.user.id),
+					user=get_identity(self.request).user,
 					action=CartActivityLogger.Addedtocart,
 					product=cart_item.name,
 					comments='added to cart')
 				logdata(json_data)
-				new_cart_entry=Cart( user=user_detail, product=cart_item, quantity=qty, product_key=key)
-				new_cart_entry.save()
 			else:
-				Cart.objects.filter(user=user_detail, product=cart_item).update(status=Cart.Inorder)
+				Cart.objects.filter(id=cart_entry.id).update(status=Cart.Inorder)
 				json_data=create_json(
-					user=CartUser.objects.get(id=self.request.user.id),
+					user=get_identity(self.request).user,
 					action=CartActivityLogger.Movedtowishlist,
 					product=cart_item.name,
 					comments='moved to cart')
@@ -822,14 +1193,6 @@ def add_cart_entry(self):
 		except Product.DoesNotExist:
 			pass	
 
-def check_if_cart_exist_or_new(cart_item,user_detail,key):
-	try:
-		Cart.objects.get(user=user_detail, product=cart_item)
-		return 1
-	except Cart.DoesNotExist:
-		print('cart does not exist')
-		return 0
-
 def update_cart_entry(self):
 	if(self.request.method == 'GET' and self.request.GET.get('qty')):
 		qty=int(self.request.GET.get('qty'))
@@ -837,7 +1200,7 @@ def update_cart_entry(self):
 		Cart.objects.filter(id=cartid).update(quantity=qty)
 		cart_item = Cart.objects.get(id=cartid)
 		json_data=create_json(
-			user=CartUser.objects.get(id=self.request.user.id),
+			user=get_identity(self.request).user,
 			action=CartActivityLogger.Updatedcart,
 			product=cart_item.product.name,
 			comments='updated quantity = '+str(cart_item.quantity))
@@ -850,7 +1213,7 @@ def update_cart_status(self):
 			cart_item=Cart.objects.get(id=cartid)
 			Cart.objects.filter(id=cartid).update(status=Cart.Incart)
 			json_data=create_json(
-				user=CartUser.objects.get(id=self.request.user.id),
+				user=get_identity(self.request).user,
 				action=CartActivityLogger.Movedtowishlist,
 				product=cart_item.product.name,
 				comments='moved to wishlist')
@@ -859,7 +1222,7 @@ def update_cart_status(self):
 			cart_item=Cart.objects.get(id=cartid)
 			Cart.objects.filter(id=cartid).update(status=Cart.Inorder)
 			json_data=create_json(
-				user=CartUser.objects.get(id=self.request.user.id),
+				user=get_identity(self.request).user,
 				action=CartActivityLogger.Movedtowishlist,
 				product=cart_item.product.name,
 				comments='moved from wishlist to cart')
@@ -869,35 +1232,39 @@ def update_cart_status(self):
 def create_order(self):
 	if(self.request.method == 'GET' and self.request.GET.get('checkout')):
 		userid = self.request.GET.get('checkout')
-		user = CartUser.objects.get(id=userid)
-		cart_items = Cart.objects.filter(user=user,status=Cart.Inorder)
-		for product in cart_items:
-			cart = Cart.objects.get(id=product.id, status = Cart.Inorder)
-			if(check_if_order_exist_or_new(cart,user)==1):
-				order_product = Product.objects.get(id=cart.product.id)
-				Order.objects.filter(user=user, product=cart.product, status=Order.Notplaced).update(quantity=cart.quantity, price=cart.quantity*order_product.cost)
-			else:
-				new_product = Product.objects.get(id=cart.product.id)
-				new_order = Order(user=user, product=new_product, quantity=cart.quantity, price=cart.quantity*new_product.cost)
-				new_order.save()
-				json_data=create_json(
-					user=CartUser.objects.get(id=self.request.user.id),
-					action=CartActivityLogger.Ordercreated,
-					product=new_product.name,
-					comments='order created quantity='+str(cart.quantity))
-				logdata(json_data)
-
-def check_if_order_exist_or_new(cart_item,user_detail):
-	try:
-		Order.objects.get(user=user_detail, product=cart_item.product, status=Order.Notplaced)
-		orderid = Order.objects.filter(user=user_detail, product=cart_item.product).order_by('-order_date')[0]
-		order = Order.objects.get(id=orderid.id)
-		if(order.status!=Order.Notplaced):
-			return 0
-		else:
-			return 1
-	except Order.DoesNotExist:
-		return 0
+		with transaction.atomic():
+			cart_items = Cart.objects.filter(user_id=userid,status=Cart.Inorder).select_related('product').only(
+				'id','quantity','product__id','product__name','product__cost')
+			lines = {}
+			for cart in cart_items:
+				lines[cart.product_id] = cart
+			if not lines:
+				return
+			pending = {}
+			# every pending order of a product is updated, older checkouts may have left several
+			for order in Order.objects.select_for_update().filter(user_id=userid, product__in=list(lines), status=Order.Notplaced).only('id','product'):
+				pending.setdefault(order.product_id, []).append(order.id)
+			new_orders = []
+			quantities = []
+			prices = []
+			for product_id, cart in lines.items():
+				price = cart.quantity*cart.product.cost
+				if product_id in pending:
+					quantities.append(When(id__in=pending[product_id], then=Value(cart.quantity)))
+					prices.append(When(id__in=pending[product_id], then=Value(price)))
+				else:
+					new_orders.append(Order(user_id=userid, product=cart.product, quantity=cart.quantity, price=price))
+			if pending:
+				Order.objects.filter(id__in=[id for ids in pending.values() for id in ids]).update(
+					updated=timezone.now(),
+					quantity=Case(*quantities, output_field=IntegerField()),
+					price=Case(*prices, output_field=IntegerField()))
+			Order.objects.bulk_create(new_orders)
+		logbatch([create_log(
+			user=get_identity(self.request).user,
+			action=CartActivityLogger.Ordercreated,
+			product=order.product.name,
+			comments='order created quantity='+str(order.quantity)) for order in new_orders])
 
 def delete_order(self):
 	if(self.request.method == 'GET' and self.request.GET.get('delorder')):
@@ -905,11 +1272,10 @@ def delete_order(self):
 		try:
 			order = Order.objects.get(id=orderid)
 			product = Product.objects.get(id=order.product.id)
-			user = CartUser.objects.get(id=self.request.user.id)
 			Order.objects.get(id=orderid).delete()
-			Cart.objects.filter(user=user,product=product).update(status=Cart.Incart)
+			Cart.objects.filter(user=get_identity(self.request).user,product=product).update(status=Cart.Incart)
 			json_data=create_json(
-				user=CartUser.objects.get(id=self.request.user.id),
+				user=get_identity(self.request).user,
 				action=CartActivityLogger.Movedtowishlist,
 				product=product.name,
 				comments='order deleted and moved to wishlist')
@@ -918,33 +1284,43 @@ def delete_order(self):
 			pass
 def add_address(self):
 	if(self.request.method == 'GET' and self.request.GET.get('address')):
-		address = self.request.GET.get('address')
-		CartUser.objects.filter(id=self.request.user.id).update(address=address)
+		get_identity(self.request).set_address(self.request.GET.get('address'))
 
 def deliver_order(self):
 	if(self.request.method == 'GET' and self.request.GET.get('deliver')):
 		userid=self.request.GET.get('deliver')
-		user=CartUser.objects.get(id=userid)
-		order_list = [order.id for order in Order.objects.filter(user=user,status=Order.Notplaced)]
-		send_confirmation_email.delay(id=user.id,orders=order_list)
-		for orders in Order.objects.filter(user=user,status=Order.Notplaced):
-			json_data=create_json(
-				user=CartUser.objects.get(id=self.request.user.id),
+		with transaction.atomic():
+			orders = list(Order.objects.select_for_update(of=('self',)).filter(user_id=userid,status=Order.Notplaced).select_related('product').only(
+				'id','quantity','product__id','product__name'))
+			lines = {}
+			for order in orders:
+				lines[order.product_id] = lines.get(order.product_id, 0)+order.quantity
+			report = reserve_stock(lines, partial=True)
+			# orders without enough stock stay pending so the buyer can change them
+			placed = [order for order in orders if order.product_id in report.reserved]
+			Order.objects.filter(id__in=[order.id for order in placed]).update(status=Order.Placed, updated=timezone.now())
+			Cart.objects.filter(user_id=userid, status=Cart.Inorder, product__in=list(report.reserved)).delete()
+		self.stock_report = report
+		if placed:
+			send_confirmation_email.delay(id=int(userid),orders=[order.id for order in placed])
+			logbatch([create_log(
+				user=get_identity(self.request).user,
 				action=CartActivityLogger.Orderplaced,
-				product=orders.product.name,
-				comments='delivery initiated quantity='+str(orders.quantity))
-			logdata(json_data)
-		Order.objects.filter(user=user,status=Order.Notplaced).update(status=Order.Placed)
-		Cart.objects.filter(user=user, status=Cart.Inorder).delete()
+				product=order.product.name,
+				comments='delivery initiated quantity='+str(order.quantity)) for order in placed])
 
 def cancel_order(self):
 	if(self.request.method == 'GET' and self.request.GET.get('cancel')):
 		orderid = self.request.GET.get('cancel')
 		try:
-			Order.objects.filter(id=orderid).update(status=Order.Cancelled)
-			order=Order.objects.get(id=orderid)
+			with transaction.atomic():
+				# only the buyer may cancel, anybody else's id is treated as missing
+				order=Order.objects.select_for_update().get(id=orderid, user=self.request.user)
+				if(order.status == Order.Placed):
+					release_stock({order.product_id:order.quantity})
+				Order.objects.filter(id=order.id).update(status=Order.Cancelled, updated=timezone.now())
 			json_data=create_json(
-				user=CartUser.objects.get(id=self.request.user.id),
+				user=get_identity(self.request).user,
 				action=CartActivityLogger.Ordercancelled,
 				product=order.product.name,
 				comments='order cancelled')
@@ -959,7 +1335,7 @@ def remove_cancelled_order(self):
 			order=Order.objects.get(id=orderid)
 			Order.objects.get(id=orderid).delete()
 			json_data=create_json(
-				user=CartUser.objects.get(id=self.request.user.id),
+				user=get_identity(self.request).user,
 				action=CartActivityLogger.Ordercancelled,
 				product=order.product.name,
 				comments='removed from orderslist')
@@ -967,6 +1343,16 @@ def remove_cancelled_order(self):
 		except Order.DoesNotExist:
 			pass
 
+# media
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+def media(request, path):
+	# uploads named by their content never change, browsers can keep them for a year
+	response = serve(request, path, document_root=settings.MEDIA_ROOT)
+	if is_immutable(path):
+		response['Cache-Control'] = IMMUTABLE_CACHE
+	return response
+
 class IndexView(ListView):
 	template_name = 'basecart/index.html'
 	model = Product
@@ -975,7 +1361,16 @@ class IndexView(ListView):
 		if(self.request.user.is_authenticated):
 			add_cart_entry(self)
 			delete_product(self)
-		return Product.objects.all()
+		self.filters = parse_filters(self.request.GET)
+		if has_filters(self.filters):
+			return search_products(**self.filters)
+		return [productcache.as_product(record) for record in productcache.get_catalog()]
+
+	def get_context_data(self, **kwargs):
+		context = super(IndexView, self).get_context_data(**kwargs)
+		context['filters'] = self.filters
+		context['categories'] = Product.CATEGORIES
+		return context
 
 #user class features
 class CartUserCreationForm(UserCreationForm):
@@ -1001,14 +1396,13 @@ class AddProductView(CreateView):
 
 	def form_valid(self,form):
 		if(self.request.user.is_authenticated):
-			userid=self.request.user.id
 			self.object = form.save(commit=False)
 			product_photo=form.cleaned_data['photo']
-			self.object.created_by = CartUser.objects.get(id=userid)
+			self.object.created_by = get_identity(self.request).user
 			self.object.photo = product_photo
 			self.object.save()
 			json_data=create_json(
-				user=CartUser.objects.get(id=userid),
+				user=get_identity(self.request).user,
 				action=CartActivityLogger.Productcreated,
 				product=form.cleaned_data['name'],
 				comments='cost='+str(form.cleaned_data['cost']))
@@ -1019,6 +1413,12 @@ class ProductDetailView(DetailView):
 	model = Product
 	template_name = 'basecart/productdetail.html'
 
+	def get_object(self, queryset=None):
+		record = productcache.get_product(self.kwargs['pk'])
+		if record is None:
+			raise Http404('product does not exist')
+		return productcache.as_product(record)
+
 class ProductEditView(UpdateView):
 	model = Product
 	template_name = 'basecart/productedit.html'
@@ -1026,9 +1426,8 @@ class ProductEditView(UpdateView):
 	success_url = reverse_lazy('index')
 	def form_valid(self,form):
 		if(self.request.user.is_authenticated):
-			userid=self.request.user.id
 			json_data=create_json(
-				user=CartUser.objects.get(id=userid),
+				user=get_identity(self.request).user,
 				action=CartActivityLogger.Productupdated,
 				product=form.cleaned_data['name'],
 				comments='NULL')
@@ -1040,7 +1439,7 @@ class MyProductsView(ListView):
 	template_name = 'basecart/myproducts.html'
 	def get_queryset(self):
 		if(self.request.user.is_authenticated):
-			return Product.objects.filter(created_by=self.request.user)
+			return Product.objects.for_listing().filter(created_by=self.request.user)
 
 # Cart class features
 class CartDetailView(ListView):
@@ -1052,7 +1451,13 @@ class CartDetailView(ListView):
 			delete_cart_entry(self)
 			update_cart_entry(self)
 			update_cart_status(self)
-		return Cart.objects.filter(user=self.request.user)
+		return Cart.objects.with_product().with_line_total().filter(user=self.request.user)
+
+	def get_context_data(self, **kwargs):
+		context = super(CartDetailView, self).get_context_data(**kwargs)
+		if(self.request.user.is_authenticated):
+			context['cart_total'] = self.object_list.filter(status=Cart.Inorder).total()
+		return context
 
 # Order class features
 class CreateOrder(ListView):
@@ -1063,7 +1468,13 @@ class CreateOrder(ListView):
 			create_order(self)
 			delete_order(self)
 			add_address(self)
-		return Order.objects.filter(user=self.request.user, status=Order.Notplaced)	
+		return Order.objects.with_product().with_line_total().filter(user=self.request.user, status=Order.Notplaced)
+
+	def get_context_data(self, **kwargs):
+		context = super(CreateOrder, self).get_context_data(**kwargs)
+		if(self.request.user.is_authenticated):
+			context['order_total'] = self.object_list.total()
+		return context
 
 class ViewOrder(ListView):
 	model = Order
@@ -1072,7 +1483,14 @@ class ViewOrder(ListView):
 		deliver_order(self)
 		cancel_order(self)
 		remove_cancelled_order(self)
-		return Order.objects.filter(user=self.request.user).order_by('-order_date')
+		return Order.objects.with_product().with_line_total().filter(user=self.request.user).order_by('-order_date')
+
+	def get_context_data(self, **kwargs):
+		context = super(ViewOrder, self).get_context_data(**kwargs)
+		report = getattr(self, 'stock_report', None)
+		if report is not None:
+			context['out_of_stock'] = list(report.failed.values())
+		return context
 
 # admin page
 def delete_cartuser(self):
@@ -1116,7 +1534,7 @@ class ProductAdmin(ListView):
 	template_name = 'administration/product/productadmin.html'
 	def get_queryset(self):
 		delete_product(self)
-		return Product.objects.all()
+		return Product.objects.with_seller()
 
 class ProductEditAdmin(UpdateView):
 	model = Product
@@ -1136,7 +1554,7 @@ class CartAdmin(ListView):
 	template_name = 'administration/cart/cartadmin.html'
 	def get_queryset(self):
 		delete_cart_entry(self)
-		return Cart.objects.all()
+		return Cart.objects.with_user_and_product()
 
 class CartEditAdmin(UpdateView):
 	model = Cart
@@ -1156,7 +1574,7 @@ class OrderAdmin(ListView):
 	template_name = 'administration/order/orderadmin.html'
 	def get_queryset(self):
 		remove_cancelled_order(self)
-		return Order.objects.all()
+		return Order.objects.with_user_and_product()
 
 class OrderEditAdmin(UpdateView):
 	model = Order
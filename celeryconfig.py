@@ -1,4 +1,6 @@
 broker_url='pyamqp://guest@localhost//'
+# publishing gives up after a few quick tries when the broker is down instead of retrying forever
+broker_transport_options = {'max_retries': 3, 'interval_start': 0, 'interval_step': 0.2, 'interval_max': 0.5}
 task_serializer = 'json'
 result_serializer = 'json'
 accept_content = ['json']
@@ -0,0 +1,9 @@
+import os
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'qbcart.settings')
+
+# start workers with `celery -A qbcart worker`, tasks are found in each app's tasks module
+app = Celery('qbcart')
+app.config_from_object('celeryconfig')
+app.autodiscover_tasks()
@@ -0,0 +1,106 @@
+"""
+Helpers for reading settings from the environment.
+
+Nothing here does I/O when settings are imported. Values that need a
+lookup, like the address of the server for ALLOWED_HOSTS, are wrapped in
+a LazyList and resolved once, by the first request that reads them.
+"""
+
+import os
+import socket
+import logging
+import threading
+from collections.abc import Sequence
+
+logger = logging.getLogger('qbcart.env')
+
+TRUE = ('1', 'true', 'yes', 'on')
+FALSE = ('0', 'false', 'no', 'off')
+
+def env(name, default=None):
+	return os.environ.get(name, default)
+
+def env_bool(name, default=None):
+	value = os.environ.get(name, '').strip().lower()
+	if value in TRUE:
+		return True
+	if value in FALSE:
+		return False
+	return default
+
+def env_int(name, default=None):
+	value = os.environ.get(name, '').strip()
+	if not value:
+		return default
+	if value.lower() == 'none':
+		return None
+	return int(value)
+
+def env_list(name, default=()):
+	value = os.environ.get(name)
+	if value is None:
+		return list(default)
+	return [item.strip() for item in value.split(',') if item.strip()]
+
+def resolve_hosts(names):
+	"""
+	Addresses of names, a name that does not resolve is left out instead
+	of stopping the process.
+	"""
+	addresses = []
+	for name in names:
+		try:
+			addresses.append(socket.gethostbyname(name))
+		except (socket.error, UnicodeError) as e:
+			logger.warning('could not resolve %s: %s', name, e)
+	return addresses
+
+class LazyList(Sequence):
+	"""
+	Read only list that is filled by calling load() the first time any
+	part of it is read.
+	"""
+
+	def __init__(self, load):
+		self._load = load
+		self._items = None
+		self._lock = threading.Lock()
+
+	@property
+	def items(self):
+		if self._items is None:
+			with self._lock:
+				if self._items is None:
+					self._items = list(self._load())
+		return self._items
+
+	def __getitem__(self, index):
+		return self.items[index]
+
+	def __len__(self):
+		return len(self.items)
+
+	def __iter__(self):
+		return iter(self.items)
+
+	def __contains__(self, item):
+		return item in self.items
+
+	def __eq__(self, other):
+		if isinstance(other, LazyList):
+			other = other.items
+		return self.items == other
+
+	__hash__ = None
+
+	def __add__(self, other):
+		return self.items+list(other)
+
+	def __radd__(self, other):
+		return list(other)+self.items
+
+	def copy(self):
+		return list(self.items)
+
+	def __repr__(self):
+		return repr(self.items)
@@ -11,7 +11,8 @@ https://docs.djangoproject.com/en/2.0/ref/settings/
 """
 
 import os
-import socket
+import sys
+from .env import env, env_bool, env_int, env_list, resolve_hosts, LazyList
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -21,14 +22,15 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # See https://docs.djangoproject.com/en/2.0/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = '%gh3!65$0o-enzk+c-o72u2ue$z3tgo2yui=5@g$s^8p5mbxxo'
+SECRET_KEY = env('DJANGO_SECRET_KEY', '%gh3!65$0o-enzk+c-o72u2ue$z3tgo2yui=5@g$s^8p5mbxxo')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# with DEBUG off connections stop recording every query in connection.queries
+DEBUG = env_bool('DJANGO_DEBUG', True)
 
-server_ip =str(socket.gethostbyname("my_server"))
-
-ALLOWED_HOSTS = ['localhost',server_ip]
+# ALLOWED_SERVER_NAMES are resolved to addresses on the first request,
+# not while settings are imported
+ALLOWED_HOSTS = LazyList(lambda: env_list('ALLOWED_HOSTS', ['localhost'])+resolve_hosts(env_list('ALLOWED_SERVER_NAMES', ['my_server'])))
 
 
 # Application definition
@@ -40,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'rest_framework_swagger',
@@ -70,11 +73,24 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'basecart.context_processors.header_counts',
             ],
         },
     },
 ]
 
+# django caches compiled templates by itself when DEBUG is off,
+# DJANGO_TEMPLATE_CACHE turns that on or off regardless of DEBUG
+TEMPLATE_CACHE = env_bool('DJANGO_TEMPLATE_CACHE')
+
+if TEMPLATE_CACHE is not None:
+    loaders = [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [('django.template.loaders.cached.Loader', loaders)] if TEMPLATE_CACHE else loaders
+
 WSGI_APPLICATION = 'qbcart.wsgi.application'
 
 
@@ -89,10 +105,34 @@ DATABASES = {
         'PASSWORD': 'qbcart',
         'HOST': 'localhost',
         'PORT':'',
+        # seconds a connection is kept for the next request, 0 closes it after every request
+        'CONN_MAX_AGE': env_int('DB_CONN_MAX_AGE', 0),
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+# products holds the product cache (basecart/productcache.py), point it at
+# memcached or redis in production through PRODUCT_CACHE_BACKEND/LOCATION
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'products': {
+        'BACKEND': os.environ.get('PRODUCT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('PRODUCT_CACHE_LOCATION', 'products'),
+    },
+}
+
+PRODUCT_CACHE_SOFT_TTL = 300
+
+PRODUCT_CACHE_HARD_TTL = 3600
+
+PRODUCT_CACHE_PAGES = 10
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -147,6 +187,13 @@ MEDIA_ROOT = os.path.join( BASE_DIR, 'media' )
 
 MEDIA_URL = '/media/'
 
+# serve MEDIA_ROOT from django, see basecart.views.media
+SERVE_MEDIA = env_bool('DJANGO_SERVE_MEDIA', DEBUG)
+
+# send make_photo_variants tasks when product photos change (basecart/images.py),
+# test runs queue nothing instead of connecting to the broker
+PRODUCT_IMAGE_QUEUE = env_bool('PRODUCT_IMAGE_QUEUE', sys.argv[1:2] != ['test'])
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 
 EMAIL_HOST = 'smtp.gmail.com'
@@ -177,4 +224,27 @@ SWAGGER_SETTINGS = {
         'type':'basic'
         }
     },
-}
\ No newline at end of file
+}
+
+# Activity log publisher (basecart/qbcartlogger.py)
+
+# test runs keep log messages in memory instead of connecting to the broker
+QBCARTLOG_ENABLED = env_bool('QBCARTLOG_ENABLED', sys.argv[1:2] != ['test'])
+
+QBCARTLOG_QUEUE = 'qbcartlog'
+
+QBCARTLOG_BROKER_HOST = 'localhost'
+
+QBCARTLOG_POOL_SIZE = 1
+
+QBCARTLOG_BUFFER_SIZE = 10000
+
+QBCARTLOG_BATCH_SIZE = 500
+
+QBCARTLOG_FLUSH_INTERVAL = 1000
+
+# REST list endpoints (basecart/pagination.py)
+
+API_PAGE_SIZE = 100
+
+API_MAX_PAGE_SIZE = 1000
@@ -1,36 +1,124 @@
 import pika
 import json
+import time
+import logging
+import argparse
 import sys, os, django
 sys.path.append("/home/qburst/Documents/Projects/Django/qbcart/qbcart") #here store is root folder(means parent).
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "qbcart.settings")
 django.setup()
 
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from basecart.models import CartActivityLogger
 
-connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
-channel = connection.channel()
+logger = logging.getLogger('qbcartlogconsumer')
 
+QUEUE_NAME = getattr(settings, 'QBCARTLOG_QUEUE', 'qbcartlog')
+BROKER_HOST = getattr(settings, 'QBCARTLOG_BROKER_HOST', 'localhost')
+BATCH_SIZE = getattr(settings, 'QBCARTLOG_BATCH_SIZE', 500)
+# milliseconds to wait for a batch to fill up before writing it anyway
+FLUSH_INTERVAL = getattr(settings, 'QBCARTLOG_FLUSH_INTERVAL', 1000)
 
-channel.queue_declare(queue='qbcartlog')
+def parse_log_time(value):
+	# older publishers sent local '%Y-%m-%d %H:%M' strings without an offset
+	parsed = parse_datetime(value)
+	if parsed is None:
+		raise ValueError('invalid date_time %r' % value)
+	if timezone.is_naive(parsed):
+		parsed = timezone.make_aware(parsed)
+	return parsed
 
-def callback(ch, method, properties, body):
-	print(type(body))
-	my_data = body.decode('utf8')
-	data = json.loads(my_data)
-	print(data)
-	log=CartActivityLogger(
+def build_log(data):
+	return CartActivityLogger(
 		username=data['user'],
 		email=data['email'],
 		product=data['product'],
 		comments=data['comments'],
-		date_and_time=data['date_time'],
+		date_and_time=parse_log_time(data['date_time']),
 		action=data['action']
 		)
-	log.save()
 
-channel.basic_consume(callback,
-					queue='qbcartlog',
-					no_ack=True)
+# what a malformed message or event raises, anything else is a real failure
+MALFORMED = (ValueError, KeyError, TypeError)
 
-print(' [*] Waiting for messages. To exit press CTRL+C')
-channel.start_consuming()
+def build_logs(body):
+	data = json.loads(body.decode('utf8'))
+	# batched publishes send a list of events in one message
+	if not isinstance(data, list):
+		return [build_log(data)]
+	logs = []
+	for item in data:
+		try:
+			logs.append(build_log(item))
+		except MALFORMED as e:
+			logger.error('dropping malformed log event %r: %s', item, e)
+	return logs
+
+def flush(channel, batch):
+	logs = []
+	for method, body in batch:
+		try:
+			logs.extend(build_logs(body))
+		except MALFORMED as e:
+			# a malformed message would otherwise be redelivered forever
+			logger.error('dropping malformed log message %r: %s', body, e)
+	with transaction.atomic():
+		CartActivityLogger.objects.bulk_create(logs)
+	# ack only after commit, a crash before this point redelivers the batch
+	channel.basic_ack(delivery_tag=batch[-1][0].delivery_tag, multiple=True)
+	return len(logs)
+
+def consume(batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, should_stop=None, on_flush=None):
+	connection = pika.BlockingConnection(pika.ConnectionParameters(host=BROKER_HOST))
+	channel = connection.channel()
+	channel.queue_declare(queue=QUEUE_NAME)
+	channel.basic_qos(prefetch_count=batch_size)
+
+	timeout = flush_interval/1000.0
+	batch = []
+	started = time.time()
+	total = 0
+	report_at = started+60
+	try:
+		for method, properties, body in channel.consume(QUEUE_NAME, inactivity_timeout=timeout):
+			if method is not None:
+				if not batch:
+					deadline = time.time()+timeout
+				batch.append((method, body))
+			if batch and (len(batch) >= batch_size or time.time() >= deadline):
+				flush_started = time.time()
+				written = flush(channel, batch)
+				total += written
+				batch = []
+				if on_flush is not None:
+					on_flush(written)
+				logger.debug('wrote %d logs in %.1fms', written, (time.time()-flush_started)*1000)
+			now = time.time()
+			if now >= report_at:
+				logger.info('%d logs written, %.1f logs/s', total, total/(now-started))
+				report_at = now+60
+			if not batch and should_stop is not None and should_stop():
+				break
+	finally:
+		if batch and channel.is_open:
+			channel.basic_nack(delivery_tag=batch[-1][0].delivery_tag, multiple=True, requeue=True)
+		if connection.is_open:
+			channel.cancel()
+			connection.close()
+	return total
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Writes qbcart activity logs from RabbitMQ to the database')
+	parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='messages written per transaction')
+	parser.add_argument('--flush-interval', type=int, default=FLUSH_INTERVAL, help='max milliseconds a batch waits before it is written')
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
+	print(' [*] Waiting for messages. To exit press CTRL+C')
+	try:
+		consume(batch_size=args.batch_size, flush_interval=args.flush_interval)
+	except KeyboardInterrupt:
+		pass
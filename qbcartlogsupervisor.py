@@ -0,0 +1,119 @@
+import os
+import time
+import signal
+import logging
+import argparse
+import multiprocessing
+
+logger = logging.getLogger('qbcartlogsupervisor')
+
+def run_worker(counter, batch_size, flush_interval):
+	stopping = multiprocessing.Event()
+
+	def stop(signum, frame):
+		stopping.set()
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+
+	def on_flush(written):
+		with counter.get_lock():
+			counter.value += written
+
+	# imported here so every worker sets up django and its db connection itself
+	import qbcartlogconsumer
+	qbcartlogconsumer.consume(
+		batch_size=batch_size,
+		flush_interval=flush_interval,
+		should_stop=stopping.is_set,
+		on_flush=on_flush)
+
+class Supervisor(object):
+
+	def __init__(self, workers, batch_size, flush_interval, report_interval=60, restart_delay=1):
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.report_interval = report_interval
+		self.restart_delay = restart_delay
+		self.counters = [multiprocessing.Value('L', 0) for i in range(workers)]
+		self.processes = [None]*workers
+		# when each dead worker is due to be started again
+		self.restart_at = [None]*workers
+		self.last_counts = [0]*workers
+		self.stopping = False
+
+	def start_worker(self, slot):
+		process = multiprocessing.Process(
+			target=run_worker,
+			name='qbcartlog-worker-%d' % slot,
+			args=(self.counters[slot], self.batch_size, self.flush_interval))
+		process.start()
+		self.processes[slot] = process
+		logger.info('started worker %d (pid %d)', slot, process.pid)
+
+	def check_workers(self):
+		# a crashing worker is restarted after restart_delay without holding up the others
+		now = time.time()
+		for slot, process in enumerate(self.processes):
+			if process.is_alive():
+				continue
+			if self.restart_at[slot] is None:
+				logger.warning('worker %d (pid %d) exited with %s, restarting in %ss', slot, process.pid, process.exitcode, self.restart_delay)
+				self.restart_at[slot] = now+self.restart_delay
+			if now >= self.restart_at[slot]:
+				self.restart_at[slot] = None
+				self.start_worker(slot)
+
+	def report(self, elapsed):
+		for slot, counter in enumerate(self.counters):
+			count = counter.value
+			rate = (count-self.last_counts[slot])/elapsed
+			self.last_counts[slot] = count
+			logger.info('worker %d (pid %d): %d logs, %.1f logs/s', slot, self.processes[slot].pid, count, rate)
+
+	def stop(self, signum=None, frame=None):
+		self.stopping = True
+
+	def shutdown(self, timeout=30):
+		# workers finish their in-flight batch before exiting
+		for process in self.processes:
+			if process.is_alive():
+				process.terminate()
+		deadline = time.time()+timeout
+		for slot, process in enumerate(self.processes):
+			process.join(max(0, deadline-time.time()))
+			if process.is_alive():
+				logger.error('worker %d (pid %d) did not stop in time, killing it', slot, process.pid)
+				process.kill()
+				process.join()
+
+	def run(self):
+		signal.signal(signal.SIGTERM, self.stop)
+		signal.signal(signal.SIGINT, self.stop)
+		for slot in range(len(self.processes)):
+			self.start_worker(slot)
+		last_report = time.time()
+		while not self.stopping:
+			time.sleep(1)
+			if self.stopping:
+				break
+			self.check_workers()
+			now = time.time()
+			if now-last_report >= self.report_interval:
+				self.report(now-last_report)
+				last_report = now
+		logger.info('shutting down %d workers', len(self.processes))
+		self.shutdown()
+
+if __name__ == '__main__':
+	# only the settings are read here, django itself is set up in each worker
+	os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'qbcart.settings')
+	from django.conf import settings
+	parser = argparse.ArgumentParser(description='Runs several qbcart activity log consumers')
+	parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='number of consumer processes')
+	parser.add_argument('--batch-size', type=int, default=getattr(settings, 'QBCARTLOG_BATCH_SIZE', 500), help='messages written per transaction')
+	parser.add_argument('--flush-interval', type=int, default=getattr(settings, 'QBCARTLOG_FLUSH_INTERVAL', 1000), help='max milliseconds a batch waits before it is written')
+	parser.add_argument('--report-interval', type=int, default=60, help='seconds between per worker rate reports')
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(name)s %(message)s')
+
+	Supervisor(args.workers, args.batch_size, args.flush_interval, args.report_interval).run()